@@ -0,0 +1,145 @@
+# cython: language_level=3
+"""
+Compiled observation and step kernels for ProgrammableMatterEnvMoore.
+
+Same interface as the Python kernels in pm_env_moore.py, without the JIT
+warm-up Numba needs. Build in place with:
+
+    cythonize -i _pm_env_kernel.pyx
+"""
+cimport cython
+from libc.math cimport sqrt
+
+# Cell types from app.models.grid
+cdef enum:
+    WALL = 1
+    ELEMENT = 2
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline bint _is_blocked(const signed char[:, ::1] cells,
+                             const unsigned char[:, ::1] obstacle_grid,
+                             Py_ssize_t x, Py_ssize_t y) nogil:
+    """Check if (x, y) is off-grid, a wall, an element or another agent."""
+    if x < 0 or y < 0 or x >= cells.shape[1] or y >= cells.shape[0]:
+        return True
+    cdef signed char cell = cells[y, x]
+    return cell == WALL or cell == ELEMENT or obstacle_grid[y, x] != 0
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _fill_obs(float[::1] obs, Py_ssize_t ax, Py_ssize_t ay, Py_ssize_t tx, Py_ssize_t ty,
+                    const signed char[:, ::1] cells, const unsigned char[:, ::1] obstacle_grid):
+    obs[0] = ax
+    obs[1] = ay
+    obs[2] = tx
+    obs[3] = ty
+
+    # All 8 Moore neighbors, unrolled in (dx, dy) order
+    obs[4] = _is_blocked(cells, obstacle_grid, ax - 1, ay - 1)
+    obs[5] = _is_blocked(cells, obstacle_grid, ax - 1, ay)
+    obs[6] = _is_blocked(cells, obstacle_grid, ax - 1, ay + 1)
+    obs[7] = _is_blocked(cells, obstacle_grid, ax, ay - 1)
+    obs[8] = _is_blocked(cells, obstacle_grid, ax, ay + 1)
+    obs[9] = _is_blocked(cells, obstacle_grid, ax + 1, ay - 1)
+    obs[10] = _is_blocked(cells, obstacle_grid, ax + 1, ay)
+    obs[11] = _is_blocked(cells, obstacle_grid, ax + 1, ay + 1)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _fill_obs_shifted(float[::1] obs, const float[::1] prev_obs, Py_ssize_t dx, Py_ssize_t dy,
+                            Py_ssize_t ax, Py_ssize_t ay, Py_ssize_t tx, Py_ssize_t ty,
+                            const signed char[:, ::1] cells,
+                            const unsigned char[:, ::1] obstacle_grid):
+    cdef Py_ssize_t i = 4, ox, oy, px, py, k
+    obs[0] = ax
+    obs[1] = ay
+    obs[2] = tx
+    obs[3] = ty
+
+    for ox in range(-1, 2):
+        for oy in range(-1, 2):
+            if ox == 0 and oy == 0:
+                continue
+            # Same cell seen from the previous position
+            px = ox + dx
+            py = oy + dy
+            if -1 <= px <= 1 and -1 <= py <= 1 and (px != 0 or py != 0):
+                k = (px + 1) * 3 + (py + 1)
+                obs[i] = prev_obs[4 + k - (k > 4)]
+            else:
+                obs[i] = _is_blocked(cells, obstacle_grid, ax + ox, ay + oy)
+            i += 1
+
+
+def fill_obs(float[::1] obs, Py_ssize_t ax, Py_ssize_t ay, Py_ssize_t tx, Py_ssize_t ty,
+             const signed char[:, ::1] cells, const unsigned char[:, ::1] obstacle_grid):
+    """Write [ax,ay,tx,ty] plus binary flags for each of 8 neighbors into obs."""
+    _fill_obs(obs, ax, ay, tx, ty, cells, obstacle_grid)
+
+
+def fill_obs_shifted(float[::1] obs, const float[::1] prev_obs, Py_ssize_t dx, Py_ssize_t dy,
+                     Py_ssize_t ax, Py_ssize_t ay, Py_ssize_t tx, Py_ssize_t ty,
+                     const signed char[:, ::1] cells, const unsigned char[:, ::1] obstacle_grid):
+    """
+    Fill obs after a move of (dx, dy), reusing the neighbor flags in
+    prev_obs that still fall inside the new 3x3 window.
+    """
+    _fill_obs_shifted(obs, prev_obs, dx, dy, ax, ay, tx, ty, cells, obstacle_grid)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def step_obs(float[::1] obs, const float[::1] prev_obs, bint reuse,
+             Py_ssize_t ax, Py_ssize_t ay, Py_ssize_t tx, Py_ssize_t ty, long long dist2,
+             Py_ssize_t dx, Py_ssize_t dy,
+             const signed char[:, ::1] cells, const unsigned char[:, ::1] obstacle_grid,
+             double collision_penalty, double success_reward):
+    """
+    Apply one move, compute its reward and write the resulting observation.
+
+    Returns:
+        Tuple of (new_ax, new_ay, new_dist2, reward)
+    """
+    # Compute new position and clip to grid bounds
+    cdef Py_ssize_t nx = min(max(ax + dx, 0), cells.shape[1] - 1)
+    cdef Py_ssize_t ny = min(max(ay + dy, 0), cells.shape[0] - 1)
+    cdef Py_ssize_t mx = nx - ax, my = ny - ay, k
+    cdef long long new_dist2
+    cdef double reward
+    cdef bint blocked
+
+    # Collision check (static grid or dynamic obstacles); a real move
+    # targets one of the 8 neighbors already flagged in prev_obs
+    if reuse and (mx != 0 or my != 0):
+        k = (mx + 1) * 3 + (my + 1)
+        blocked = prev_obs[4 + k - (k > 4)] != 0
+    else:
+        blocked = _is_blocked(cells, obstacle_grid, nx, ny)
+
+    if blocked:
+        # illegal: revert and heavy penalty
+        nx = ax
+        ny = ay
+        mx = 0
+        my = 0
+        new_dist2 = dist2
+        reward = collision_penalty
+    else:
+        # (d + m)^2 = d^2 + (2d + m) * m per axis
+        new_dist2 = dist2 + (2 * (ax - tx) + mx) * mx + (2 * (ay - ty) + my) * my
+
+        # shaped reward: closer → positive, big bonus on success
+        reward = (sqrt(<double>dist2) - sqrt(<double>new_dist2)) * 2.0
+        if new_dist2 == 0:
+            reward += success_reward
+
+    # Observation at the resulting position, in the same pass
+    if reuse:
+        _fill_obs_shifted(obs, prev_obs, mx, my, nx, ny, tx, ty, cells, obstacle_grid)
+    else:
+        _fill_obs(obs, nx, ny, tx, ty, cells, obstacle_grid)
+    return nx, ny, new_dist2, reward
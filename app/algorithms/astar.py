@@ -1,5 +1,11 @@
 import heapq
 
+from app.models.grid import WALL, ELEMENT
+
+# Neighbor offsets in the order Grid.get_neighbors yields them
+_VON_NEUMANN_DELTAS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+_MOORE_DELTAS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
 def manhattan_distance(x1, y1, x2, y2):
     """Calculate the Manhattan distance between two points."""
     return abs(x1 - x2) + abs(y1 - y2)
@@ -105,4 +111,87 @@ def astar_pathfind(grid, start_x, start_y, goal_x, goal_y, topology="vonNeumann"
     
     # If no path is found
     print(f"No path found from ({start_x}, {start_y}) to ({goal_x}, {goal_y}) after exploring {nodes_explored} nodes")
-    return None, nodes_explored
\ No newline at end of file
+    return None, nodes_explored
+
+def astar_pathfind_cells(cells, start_x, start_y, goal_x, goal_y, topology="vonNeumann"):
+    """
+    A* search over a nested-list copy of the grid cells.
+    
+    Explores in the same order as astar_pathfind and returns the same paths,
+    but reads cells from plain lists and skips the per-call logging, so a
+    caller running many searches can share one copy of the board and keep
+    it in sync itself.
+    
+    Args:
+        cells: Grid cells as cells[y][x] lists, e.g. grid.grid.tolist()
+        start_x, start_y: Starting position
+        goal_x, goal_y: Goal position
+        topology: Grid topology ("vonNeumann" or "moore")
+    
+    Returns:
+        List of (x, y) positions forming a path from start to goal,
+        and number of nodes explored
+    """
+    height, width = len(cells), len(cells[0])
+    
+    # Check if start and goal are valid positions and not walls
+    if not (0 <= start_x < width and 0 <= start_y < height and
+            0 <= goal_x < width and 0 <= goal_y < height):
+        return None, 0
+    if cells[start_y][start_x] == WALL or cells[goal_y][goal_x] == WALL:
+        return None, 0
+    
+    # If start is the goal, return a single-element path
+    if start_x == goal_x and start_y == goal_y:
+        return [(start_x, start_y)], 1
+    
+    if topology == "vonNeumann":
+        deltas = _VON_NEUMANN_DELTAS
+    elif topology == "moore":
+        deltas = _MOORE_DELTAS
+    else:
+        deltas = ()
+    
+    open_set = [(0, 0, (start_x, start_y))]
+    open_set_positions = {(start_x, start_y)}
+    g_score = {(start_x, start_y): 0}
+    parent = {}
+    counter = 1
+    nodes_explored = 0
+    
+    while open_set:
+        _, _, current_pos = heapq.heappop(open_set)
+        current_x, current_y = current_pos
+        open_set_positions.remove(current_pos)
+        nodes_explored += 1
+        
+        if current_x == goal_x and current_y == goal_y:
+            path = [current_pos]
+            current = current_pos
+            while current in parent:
+                current = parent[current]
+                path.append(current)
+            path.reverse()
+            return path, nodes_explored
+        
+        tentative_g_score = g_score[current_pos] + 1
+        for dx, dy in deltas:
+            next_x, next_y = current_x + dx, current_y + dy
+            if not (0 <= next_x < width and 0 <= next_y < height):
+                continue
+            
+            # Skip if the position is occupied by another element
+            if cells[next_y][next_x] == ELEMENT:
+                continue
+            
+            next_pos = (next_x, next_y)
+            if next_pos not in g_score or tentative_g_score < g_score[next_pos]:
+                parent[next_pos] = current_pos
+                g_score[next_pos] = tentative_g_score
+                f_score = tentative_g_score + abs(next_x - goal_x) + abs(next_y - goal_y)
+                if next_pos not in open_set_positions:
+                    heapq.heappush(open_set, (f_score, counter, next_pos))
+                    counter += 1
+                    open_set_positions.add(next_pos)
+    
+    return None, nodes_explored
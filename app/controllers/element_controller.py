@@ -7,6 +7,7 @@ class ElementController:
         self.grid = grid
         self.elements = {}  # Dictionary of element_id -> Element
         self.target_positions = []  # List of (x, y) tuples for target positions
+        self.generation = 0  # Bumped whenever the element set changes
     
     def add_element(self, element_id, x, y):
         """Add a new element to the controller."""
@@ -14,6 +15,7 @@ class ElementController:
             element = Element(element_id, x, y)
             self.elements[element_id] = element
             self.grid.add_element(element)
+            self.generation += 1
             return element
         return None
     
@@ -23,6 +25,7 @@ class ElementController:
             element = self.elements[element_id]
             self.grid.remove_element(element)
             del self.elements[element_id]
+            self.generation += 1
             return True
         return False
     
@@ -1,14 +1,20 @@
 #last time done
+import os
 import time
 import heapq
+import pickle
 import random
-from app.models.grid import Grid
+import numpy as np
+from app.models.grid import Grid, ELEMENT
 from app.models.shape import ShapeGenerator
 from app.controllers.element_controller import ElementController
-from app.algorithms.astar import astar_pathfind
+from app.algorithms.astar import astar_pathfind, astar_pathfind_cells
 from app.algorithms.bfs import bfs_pathfind
 from app.algorithms.greedy import greedy_pathfind
 
+# Per-element and per-step logging; set PM_DEBUG=1 to enable
+DEBUG = os.getenv("PM_DEBUG", "0") == "1"
+
 
 class ProgrammableMatterSimulation:
     """Main simulation class for the programmable matter system."""
@@ -30,8 +36,36 @@ class ProgrammableMatterSimulation:
         """
         self.grid.clear_grid()
         self.controller.elements.clear()
+        self.controller.generation += 1
         self.controller.target_positions = []
 
+    def snapshot(self):
+        """
+        Capture the grid cells, elements and targets so they can be restored
+        without re-running element placement and target generation.
+        
+        Returns:
+            Opaque bytes for restore()
+        """
+        return pickle.dumps((self.grid.grid, self.controller.elements,
+                             self.controller.target_positions, self.shape_type))
+
+    def restore(self, snapshot):
+        """
+        Restore the state captured by snapshot().
+        
+        The grid and controller objects are kept (other components hold
+        references to them); only their contents are replaced.
+        """
+        cells, elements, target_positions, shape_type = pickle.loads(snapshot)
+        self.grid.grid[:] = cells
+        self.grid.occupancy[:] = cells == ELEMENT
+        self.grid.version += 1
+        self.controller.elements = elements
+        self.controller.target_positions = target_positions
+        self.controller.generation += 1
+        self.shape_type = shape_type
+
     def initialize_elements(self, num_elements):
         """
         Initialize the specified number of elements at the bottom of the grid.
@@ -66,9 +100,10 @@ class ProgrammableMatterSimulation:
                 break  # Stop if all elements are placed
 
         # Debug: Print the positions of the placed elements
-        print(f"Initialized {elements_placed} elements:")
-        for element_id, element in self.controller.elements.items():
-            print(f"  Element {element_id}: ({element.x}, {element.y})")
+        if DEBUG:
+            print(f"Initialized {elements_placed} elements:")
+            for element_id, element in self.controller.elements.items():
+                print(f"  Element {element_id}: ({element.x}, {element.y})")
 
         return self.controller.elements
 
@@ -82,16 +117,37 @@ class ProgrammableMatterSimulation:
             shape_type, num_elements, self.grid.width, self.grid.height)
         
         # Validate target positions are within the grid and not on walls
-        valid_targets = []
-        for x, y in target_positions:
-            if self.grid.is_valid_position(x, y) and not self.grid.is_wall(x, y):
-                valid_targets.append((x, y))
-            else:
-                print(f"Warning: Target position ({x}, {y}) is invalid and will be ignored")
+        valid = ShapeGenerator.valid_position_mask(target_positions, self.grid)
+        for x, y in target_positions[~valid].tolist():
+            print(f"Warning: Target position ({x}, {y}) is invalid and will be ignored")
+        valid_targets = list(map(tuple, target_positions[valid].tolist()))
         
         self.controller.set_target_positions(valid_targets)
         return valid_targets
 
+    def element_arrays(self):
+        """
+        Element ids, positions and targets as struct-of-arrays columns.
+        
+        A snapshot for array code that would otherwise walk the elements
+        dict; it does not follow later moves. Elements without a target get
+        a target of (-1, -1).
+        
+        Returns:
+            Tuple of int16 arrays (ids, xs, ys, target_xs, target_ys), in
+            elements dict order
+        """
+        elements = self.controller.elements.values()
+        n = len(elements)
+        cols = np.fromiter(
+            (v for e in elements for v in (
+                e.id, e.x, e.y,
+                -1 if e.target_x is None else e.target_x,
+                -1 if e.target_y is None else e.target_y)),
+            dtype=np.int16, count=5 * n
+        ).reshape(n, 5)
+        return tuple(np.ascontiguousarray(cols.T))
+
     def find_path(self, start_x, start_y, goal_x, goal_y, algorithm="astar", topology="vonNeumann", controller=None, element_id=None):
         """Find a path using the specified algorithm."""
         try:
@@ -121,6 +177,23 @@ class ProgrammableMatterSimulation:
             traceback.print_exc()
             return None, 0
    
+    def find_path_fast(self, start_x, start_y, goal_x, goal_y, cells, topology="vonNeumann"):
+        """
+        A* path over a caller-maintained cells[y][x] copy of the grid.
+        
+        Same result as find_path(..., algorithm="astar") on a grid matching
+        cells, for batches of searches that share one copy of the board.
+        """
+        # Only check if goal is occupied by another element when it's not the element's current position
+        if ((start_x != goal_x or start_y != goal_y) and
+                0 <= goal_x < self.grid.width and 0 <= goal_y < self.grid.height and
+                cells[goal_y][goal_x] == ELEMENT):
+            if DEBUG:
+                print(f"Goal position ({goal_x}, {goal_y}) is blocked by another agent")
+            return None, 0
+        
+        return astar_pathfind_cells(cells, start_x, start_y, goal_x, goal_y, topology)
+   
     def transform(self, algorithm="astar", topology="vonNeumann", movement="sequential", control_mode="centralized"):
         """Transform the elements to the target shape."""
         start_time = time.time()
@@ -506,7 +579,8 @@ class ProgrammableMatterSimulation:
         
         # Simulate distributed movement until all elements reach targets or max steps reached
         while current_step < max_steps:
-            print(f"\nStep {current_step + 1}")
+            if DEBUG:
+                print(f"\nStep {current_step + 1}")
             
             # Check if all elements have reached their targets
             all_elements = [e for e in self.controller.elements.values() if e.has_target()]
@@ -514,7 +588,8 @@ class ProgrammableMatterSimulation:
             
             # Report progress
             at_target_percentage = 100 * len(elements_at_target) / len(all_elements) if all_elements else 0
-            print(f"Progress: {len(elements_at_target)}/{len(all_elements)} elements at target ({at_target_percentage:.1f}%)")
+            if DEBUG:
+                print(f"Progress: {len(elements_at_target)}/{len(all_elements)} elements at target ({at_target_percentage:.1f}%)")
             
             if len(elements_at_target) == len(all_elements):
                 print("All elements have reached their targets!")
@@ -548,7 +623,8 @@ class ProgrammableMatterSimulation:
                 
                 # Check if element has reached its target
                 if element.x == element.target_x and element.y == element.target_y:
-                    print(f"Element {element_id} has reached its target at ({element.x}, {element.y})")
+                    if DEBUG:
+                        print(f"Element {element_id} has reached its target at ({element.x}, {element.y})")
                     reached_targets.add(element_id)
                     if element_id in blocked_elements:
                         blocked_elements.remove(element_id)
@@ -820,7 +896,8 @@ class ProgrammableMatterSimulation:
                         final_moves.append((element, pos))
                     else:
                         # Log conflict
-                        print(f"Movement conflict: Element {element.id} and Element {planned_positions[pos].id} both want position {pos}")
+                        if DEBUG:
+                            print(f"Movement conflict: Element {element.id} and Element {planned_positions[pos].id} both want position {pos}")
                 
                 # Replace with conflict-resolved moves
                 moves_this_round = final_moves
@@ -828,7 +905,8 @@ class ProgrammableMatterSimulation:
             # Check for global deadlock - no movement in this round
             if not moves_this_round:
                 global_no_movement_counter += 1
-                print(f"No movement detected in step {current_step + 1}. Global no-movement counter: {global_no_movement_counter}")
+                if DEBUG:
+                    print(f"No movement detected in step {current_step + 1}. Global no-movement counter: {global_no_movement_counter}")
                 
                 # If no movement for several consecutive rounds, we have a global deadlock
                 if global_no_movement_counter >= max_no_movement_threshold:
@@ -867,7 +945,8 @@ class ProgrammableMatterSimulation:
             else:
                 # Reset global deadlock counter when there's movement
                 if global_no_movement_counter > 0:
-                    print(f"Movement detected, resetting global no-movement counter from {global_no_movement_counter} to 0")
+                    if DEBUG:
+                        print(f"Movement detected, resetting global no-movement counter from {global_no_movement_counter} to 0")
                     global_no_movement_counter = 0
                     
                     # If we had previously identified blocked elements but now have movement,
@@ -902,7 +981,8 @@ class ProgrammableMatterSimulation:
                         valid_moves_this_round.append((element, (next_x, next_y)))
                     else:
                         # Conflict: two agents want to move to the same cell
-                        print(f"Agent {element.id} move to ({next_x}, {next_y}) skipped due to reservation conflict with Agent {reservations[(next_x, next_y)]})")
+                        if DEBUG:
+                            print(f"Agent {element.id} move to ({next_x}, {next_y}) skipped due to reservation conflict with Agent {reservations[(next_x, next_y)]})")
 
 
                 # Execute the moves for this round
@@ -920,7 +1000,8 @@ class ProgrammableMatterSimulation:
                         total_moves.append(move)
                         executed_move_count += 1
                         
-                        print(f"Moved Element {element.id} from ({old_pos[0]}, {old_pos[1]}) to ({next_x}, {next_y})")
+                        if DEBUG:
+                            print(f"Moved Element {element.id} from ({old_pos[0]}, {old_pos[1]}) to ({next_x}, {next_y})")
                         
                         # If this was a blocked element that moved, remove it from blocked list
                         if element.id in blocked_elements:
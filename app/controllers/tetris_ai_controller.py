@@ -1,9 +1,16 @@
 # app/controllers/tetris_ai_controller.py
 import random
 import math
+import time
 import numpy as np
 from app.models.tetris_piece import TetrisPiece
 
+# Transposition table entry flags and size (power of two)
+TT_EXACT = 0
+TT_LOWER = 1
+TT_UPPER = 2
+TT_SIZE = 1 << 20
+
 class TetrisAIController:
     """
     AI controller for Tetris game using Minimax algorithm.
@@ -23,6 +30,7 @@ class TetrisAIController:
         
         # AI parameters
         self.search_depth = 3  # Default depth for minimax search
+        self.time_budget = 0.5  # Seconds allowed per decision for iterative deepening
         self.use_expectimax = False  # Whether to use expectimax instead of minimax
         self.learning_enabled = False  # Whether to use learning to improve decisions
         
@@ -38,6 +46,15 @@ class TetrisAIController:
             'blockage': -0.5      # Weight for blockage of PM access to rows
         }
         
+        # Transposition table for minimax: index -> (key, depth, value, flag, best_move)
+        self.transposition_table = {}
+        self._zobrist_rng = random.Random(0)
+        self._zobrist_cells = None
+        self._zobrist_pieces = {
+            piece_type: self._zobrist_rng.getrandbits(64) for piece_type in TetrisPiece.SHAPES
+        }
+        self._zobrist_max = self._zobrist_rng.getrandbits(64)
+        
         # Decision history for learning
         self.decision_history = []
         self.feature_history = []
@@ -192,6 +209,11 @@ class TetrisAIController:
         """
         Find the best placement using minimax or expectimax algorithm.
         
+        Searches with iterative deepening up to search_depth, trying the
+        previous depth's best placement first so alpha-beta prunes more of
+        the remaining ones. Stops deepening once time_budget is exceeded and
+        keeps the result of the last fully searched depth.
+        
         Args:
             possible_placements: List of valid (x, rotation) placements
             
@@ -200,15 +222,56 @@ class TetrisAIController:
         """
         if not possible_placements:
             return None
+        
+        deadline = time.time() + self.time_budget
+        best_placement = None
+        evaluated_states = []
+        
+        for depth in range(1, max(self.search_depth, 1) + 1):
+            # Principal variation from the previous depth goes first
+            ordered = possible_placements
+            if best_placement is not None:
+                ordered = [best_placement] + [p for p in possible_placements if p != best_placement]
+            
+            result = self._search_root(ordered, depth, deadline if depth > 1 else None)
+            if result is None:
+                # Out of time, keep the last completed depth
+                break
+            best_placement, evaluated_states = result
+            
+            if time.time() > deadline:
+                break
+        
+        self.evaluated_states.extend(evaluated_states)
+        return best_placement
+    
+    def _search_root(self, placements, depth, deadline):
+        """
+        Search all root placements to the given depth.
+        
+        Args:
+            placements: Ordered list of (x, rotation) placements
+            depth: Search depth including the root placement
+            deadline: time.time() value to abort at, or None
             
+        Returns:
+            Tuple (best_placement, evaluated_states), or None if the deadline passed
+        """
         best_placement = None
         best_score = float('-inf')
+        evaluated_states = []
         
-        for placement in possible_placements:
+        # Hash the current board once; placements update it incrementally
+        root_state = self.clone_game_state()
+        
+        for placement in placements:
+            if deadline is not None and time.time() > deadline:
+                return None
+            
             x, rotation = placement
             
-            # Create a copy of the game state for simulation
-            test_state = self.clone_game_state()
+            # Copy the root state for simulation
+            test_state = self.clone_state(root_state)
             
             # Simulate placing the piece
             piece_result = self.simulate_placement(test_state, x, rotation)
@@ -216,19 +279,20 @@ class TetrisAIController:
             if not piece_result['valid']:
                 continue
             
-            # If using expectimax with search_depth > 1, look ahead
-            if self.use_expectimax and self.search_depth > 1:
+            # If using expectimax with depth > 1, look ahead
+            if self.use_expectimax and depth > 1:
                 # Calculate score using expectimax
-                score = self.expectimax(test_state, self.search_depth - 1, False)
-            elif self.search_depth > 1:
-                # Calculate score using minimax
-                score = self.minimax(test_state, self.search_depth - 1, float('-inf'), float('inf'), False)
+                score = self.expectimax(test_state, depth - 1, False)
+            elif depth > 1:
+                # Calculate score using minimax; the best root score so far
+                # is a lower bound for every remaining placement
+                score = self.minimax(test_state, depth - 1, best_score, float('inf'), False)
             else:
                 # Just evaluate the immediate result
                 score = self.evaluate_state(test_state)
             
             # Add state to evaluated states for visualization
-            self.evaluated_states.append({
+            evaluated_states.append({
                 'placement': placement,
                 'score': score,
                 'state': test_state
@@ -239,11 +303,12 @@ class TetrisAIController:
                 best_score = score
                 best_placement = placement
         
-        return best_placement
+        return best_placement, evaluated_states
     
     def minimax(self, state, depth, alpha, beta, is_maximizing):
         """
-        Minimax algorithm with alpha-beta pruning.
+        Minimax algorithm with alpha-beta pruning and a Zobrist-keyed
+        transposition table.
         
         Args:
             state: The game state to evaluate
@@ -255,17 +320,44 @@ class TetrisAIController:
         Returns:
             Score of the best move
         """
+        # Probe the transposition table
+        key = state['hash'] ^ self._zobrist_pieces.get(state['current_piece'], 0)
+        if is_maximizing:
+            key ^= self._zobrist_max
+        index = key & (TT_SIZE - 1)
+        entry = self.transposition_table.get(index)
+        best_move = None
+        alpha_orig, beta_orig = alpha, beta
+        
+        if entry is not None and entry[0] == key:
+            best_move = entry[4]
+            if entry[1] >= depth:
+                value, flag = entry[2], entry[3]
+                if flag == TT_EXACT:
+                    return value
+                if flag == TT_LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if beta <= alpha:
+                    return value
+        
         # Terminal conditions
         if depth == 0 or state['game_over']:
-            return self.evaluate_state(state)
+            value = self.evaluate_state(state)
+            self._store_transposition(index, key, depth, value, TT_EXACT, None)
+            return value
         
         if is_maximizing:
             # Maximizing player (AI placing pieces optimally)
             max_eval = float('-inf')
             current_piece = state['current_piece']
             
-            # Get all possible placements
+            # Get all possible placements, trying the stored best move first
             placements = self.get_possible_placements_for_state(state, current_piece)
+            if best_move in placements:
+                placements.remove(best_move)
+                placements.insert(0, best_move)
             
             for placement in placements:
                 x, rotation = placement
@@ -279,13 +371,17 @@ class TetrisAIController:
                 
                 # Recursive evaluation
                 eval = self.minimax(next_state, depth - 1, alpha, beta, False)
-                max_eval = max(max_eval, eval)
+                if eval > max_eval:
+                    max_eval = eval
+                    best_move = placement
                 
                 # Alpha-beta pruning
                 alpha = max(alpha, eval)
                 if beta <= alpha:
                     break
-                    
+            
+            self._store_transposition(index, key, depth, max_eval,
+                                      self._bound_flag(max_eval, alpha_orig, beta_orig), best_move)
             return max_eval
             
         else:
@@ -294,6 +390,9 @@ class TetrisAIController:
             
             # Get potential next pieces (all possible piece types)
             next_pieces = list(TetrisPiece.SHAPES.keys())
+            if best_move in next_pieces:
+                next_pieces.remove(best_move)
+                next_pieces.insert(0, best_move)
             
             for piece_type in next_pieces:
                 # Clone state and set next piece
@@ -303,15 +402,55 @@ class TetrisAIController:
                 
                 # Recursive evaluation
                 eval = self.minimax(next_state, depth - 1, alpha, beta, True)
-                min_eval = min(min_eval, eval)
+                if eval < min_eval:
+                    min_eval = eval
+                    best_move = piece_type
                 
                 # Alpha-beta pruning
                 beta = min(beta, eval)
                 if beta <= alpha:
                     break
-                    
+            
+            self._store_transposition(index, key, depth, min_eval,
+                                      self._bound_flag(min_eval, alpha_orig, beta_orig), best_move)
             return min_eval
     
+    def _bound_flag(self, value, alpha, beta):
+        """Classify a search result against the window it was searched with."""
+        if value <= alpha:
+            return TT_UPPER
+        if value >= beta:
+            return TT_LOWER
+        return TT_EXACT
+    
+    def _store_transposition(self, index, key, depth, value, flag, best_move):
+        """Store a search result, replacing only shallower (or equal) entries."""
+        entry = self.transposition_table.get(index)
+        if entry is None or entry[0] != key or entry[1] <= depth:
+            self.transposition_table[index] = (key, depth, value, flag, best_move)
+    
+    def board_hash(self, board):
+        """
+        Zobrist hash of the board occupancy.
+        
+        Args:
+            board: 2D list of cells (None for empty)
+            
+        Returns:
+            64-bit integer hash
+        """
+        rows, cols = len(board), len(board[0])
+        if self._zobrist_cells is None or len(self._zobrist_cells) != rows or len(self._zobrist_cells[0]) != cols:
+            self._zobrist_cells = [[self._zobrist_rng.getrandbits(64) for _ in range(cols)] for _ in range(rows)]
+            self.transposition_table.clear()
+        
+        h = 0
+        for row, keys in zip(board, self._zobrist_cells):
+            for cell, k in zip(row, keys):
+                if cell is not None:
+                    h ^= k
+        return h
+    
     def expectimax(self, state, depth, is_maximizing):
         """
         Expectimax algorithm for handling uncertainty.
@@ -553,6 +692,7 @@ class TetrisAIController:
         # Create state dictionary
         state = {
             'board': board_copy,
+            'hash': self.board_hash(board_copy),
             'current_piece': self.game.currentPiece.shape_type if self.game.currentPiece else None,
             'next_piece': self.game.nextPiece,
             'score': self.game.score,
@@ -573,6 +713,7 @@ class TetrisAIController:
         # Create new state dictionary
         new_state = {
             'board': board_copy,
+            'hash': state['hash'],
             'current_piece': state['current_piece'],
             'next_piece': state['next_piece'],
             'score': state['score'],
@@ -598,25 +739,69 @@ class TetrisAIController:
     
     def simulate_placement(self, state, x, rotation):
         """
-        Simulate placing a piece in the given state.
+        Hard-drop the state's current piece at column x, clearing full lines.
         
         Args:
-            state: Game state to modify
+            state: Game state to modify in place (board, hash, score, lines)
             x: Target x-coordinate
             rotation: Target rotation
             
         Returns:
             Dictionary with placement result
         """
-        # This is a simplified version for the state-based minimax
-        # In a real implementation, this would simulate the piece drop
-        # and update the state accordingly
+        board = state['board']
+        shapes = TetrisPiece.SHAPES.get(state['current_piece'])
+        width, height = len(board[0]), len(board)
+        if shapes is None or rotation >= len(shapes):
+            return {'valid': False, 'lines_cleared': 0, 'score_increase': 0}
+        shape = [(x + dx, dy) for dx, dy in shapes[rotation]]
+        if any(col < 0 or col >= width for col, _ in shape):
+            return {'valid': False, 'lines_cleared': 0, 'score_increase': 0}
+        
+        # Hard drop from above the board: the piece stops one row above the
+        # highest filled cell under any of its blocks
+        land_y = height
+        for col, dy in shape:
+            top = 0
+            while top < height and board[top][col] is None:
+                top += 1
+            land_y = min(land_y, top - dy - 1)
+        
+        # Lock the blocks, XORing each new cell's key into the hash
+        keys = self._zobrist_cells
+        h = state['hash']
+        touched = set()
+        for col, dy in shape:
+            y = land_y + dy
+            if y < 0:
+                # Block sticks out above the board
+                state['game_over'] = True
+                continue
+            board[y][col] = state['current_piece']
+            h ^= keys[y][col]
+            touched.add(y)
+        
+        # Only rows the piece touched can have been completed
+        full_rows = [y for y in touched if all(cell is not None for cell in board[y])]
+        score_increase = 0
+        if full_rows:
+            for y in sorted(full_rows, reverse=True):
+                del board[y]
+            for _ in full_rows:
+                board.insert(0, [None] * width)
+            # Every row above a cleared one moved, so rehash from scratch
+            h = self.board_hash(board)
+            
+            score_increase = {1: 40, 2: 100, 3: 300, 4: 1200}.get(len(full_rows), 0) * state['level']
+            state['score'] += score_increase
+            state['lines'] += len(full_rows)
+            state['level'] = state['lines'] // 10 + 1
+        state['hash'] = h
         
-        # For now, just return a placeholder result
         return {
             'valid': True,
-            'lines_cleared': 0,
-            'score_increase': 0
+            'lines_cleared': len(full_rows),
+            'score_increase': score_increase
         }
     
     def update_weights_from_learning(self):
@@ -638,6 +823,9 @@ class TetrisAIController:
             
             # Adjust weight based on correlation
             self.weights[feature] += learning_rate * correlation
+        
+        # Stored values were scored with the old weights
+        self.transposition_table.clear()
     
     def calculate_correlation(self, x, y):
         """Calculate correlation between two lists of values."""
@@ -40,8 +40,14 @@ class TetrisGameController:
         self.can_hold = True  # Whether player can hold a piece (once per drop)
         
         # Grid state for Tetris blocks (separate from programmable matter)
-        # 0 = empty, other values represent locked pieces by color
-        self.tetris_grid = [[0 for _ in range(grid_width)] for _ in range(grid_height)]
+        # Packed row-major as one byte per cell, indexed by y * grid_width + x
+        # 0 = empty, other values are TetrisPiece.CODES of locked pieces
+        self.tetris_grid = bytearray(grid_width * grid_height)
+        
+        # Cells written since the last consume_dirty() call, as (x, y, value);
+        # _grid_replaced means the grid changed wholesale (new game, row clear)
+        self._dirty_cells = []
+        self._grid_replaced = True
         
         # Timing control
         self.last_drop_time = 0
@@ -67,7 +73,8 @@ class TetrisGameController:
         self.lines_cleared = 0
         self.game_over = False
         self.paused = False
-        self.tetris_grid = [[0 for _ in range(self.grid_width)] for _ in range(self.grid_height)]
+        self.tetris_grid = bytearray(self.grid_width * self.grid_height)
+        self._grid_replaced = True
         self.metrics = {key: 0 for key in self.metrics}
         
         # Generate first pieces
@@ -75,8 +82,8 @@ class TetrisGameController:
         self._spawn_new_piece()
         
         # Set timing
-        self.start_time = time.time()
-        self.last_drop_time = time.time()
+        self.start_time = time.perf_counter()
+        self.last_drop_time = time.perf_counter()
         
         return True
     
@@ -89,11 +96,11 @@ class TetrisGameController:
         
         if self.paused:
             # Store elapsed time when pausing
-            self.elapsed_time += time.time() - self.start_time
+            self.elapsed_time += time.perf_counter() - self.start_time
         else:
             # Reset start time when unpausing
-            self.start_time = time.time()
-            self.last_drop_time = time.time()
+            self.start_time = time.perf_counter()
+            self.last_drop_time = time.perf_counter()
             
         return self.paused
     
@@ -102,7 +109,7 @@ class TetrisGameController:
         Update the game state. Should be called on each game loop iteration.
         
         Args:
-            current_time: Current game time (from time.time())
+            current_time: Current game time (from time.perf_counter())
             
         Returns:
             Dict with game state update information
@@ -304,9 +311,17 @@ class TetrisGameController:
         self.current_piece.lock()
         
         # Add piece to grid
+        width = self.grid_width
+        code = TetrisPiece.CODES[self.current_piece.shape_type]
         for x, y in self.current_piece.get_positions():
-            if 0 <= x < self.grid_width and 0 <= y < self.grid_height:
-                self.tetris_grid[y][x] = self.current_piece.shape_type
+            if 0 <= x < width and 0 <= y < self.grid_height:
+                self.tetris_grid[y * width + x] = code
+                self._dirty_cells.append((x, y, code))
+        
+        # Nobody is consuming changes; stop tracking them cell by cell
+        if len(self._dirty_cells) > len(self.tetris_grid):
+            self._grid_replaced = True
+            self._dirty_cells = []
         
         # Update metrics
         self.metrics['pieces_placed'] += 1
@@ -319,19 +334,19 @@ class TetrisGameController:
             Number of lines cleared
         """
         lines_cleared = 0
+        width = self.grid_width
         
         # Check each row from bottom to top
-        for y in range(self.grid_height - 1, -1, -1):
-            # Check if row is full
-            if all(cell != 0 for cell in self.tetris_grid[y]):
+        y = self.grid_height - 1
+        while y >= 0:
+            # Check if row is full (a C-level byte search on the packed row)
+            if 0 not in self.tetris_grid[y * width:(y + 1) * width]:
                 lines_cleared += 1
                 
-                # Clear the row
-                for row in range(y, 0, -1):
-                    self.tetris_grid[row] = self.tetris_grid[row - 1].copy()
-                    
-                # Empty the top row
-                self.tetris_grid[0] = [0 for _ in range(self.grid_width)]
+                # Clear the row; the row shifted into y is checked next
+                self.clear_row(y)
+            else:
+                y -= 1
         
         # Add to total lines cleared
         self.lines_cleared += lines_cleared
@@ -350,6 +365,53 @@ class TetrisGameController:
             
         return lines_cleared
     
+    def clear_row(self, y):
+        """
+        Remove a row from the grid, shifting every row above it down by one.
+        
+        Args:
+            y: Index of the row to remove
+        """
+        width = self.grid_width
+        
+        # Shift rows 0..y-1 down in a single slice move, then empty the top row
+        self.tetris_grid[width:(y + 1) * width] = self.tetris_grid[:y * width]
+        self.tetris_grid[:width] = bytes(width)
+        self._grid_replaced = True
+    
+    def replace_grid(self, cells):
+        """
+        Overwrite the whole grid.
+        
+        Args:
+            cells: grid_width * grid_height bytes of cell codes, row-major
+        """
+        self.tetris_grid[:] = cells
+        self._grid_replaced = True
+    
+    def consume_dirty(self):
+        """
+        Get the grid cells changed since the last call, and reset tracking.
+        
+        Returns:
+            List of (x, y, value) cell writes, or None if the grid changed
+            wholesale and must be re-read in full
+        """
+        dirty = None if self._grid_replaced else self._dirty_cells
+        self._dirty_cells = []
+        self._grid_replaced = False
+        return dirty
+    
+    def get_grid_rows(self):
+        """
+        Get a row-wise copy of the packed grid.
+        
+        Returns:
+            List of rows, each a list of cell codes
+        """
+        width = self.grid_width
+        return [list(self.tetris_grid[y * width:(y + 1) * width]) for y in range(self.grid_height)]
+    
     def _update_score(self, lines_cleared):
         """
         Update score based on lines cleared and level.
@@ -416,7 +478,7 @@ class TetrisGameController:
                 return True
                 
             # Check collision with locked pieces (if position is within grid)
-            if y >= 0 and self.tetris_grid[y][x] != 0:
+            if y >= 0 and self.tetris_grid[y * self.grid_width + x] != 0:
                 return True
                 
         return False
@@ -451,10 +513,10 @@ class TetrisGameController:
         if self.paused:
             total_time = self.elapsed_time
         else:
-            total_time = self.elapsed_time + (time.time() - self.start_time)
+            total_time = self.elapsed_time + (time.perf_counter() - self.start_time)
             
         state = {
-            'grid': self.tetris_grid,
+            'grid': self.get_grid_rows(),
             'current_piece': self.current_piece.get_positions() if self.current_piece else None,
             'current_piece_type': self.current_piece.shape_type if self.current_piece else None,
             'next_piece': self.next_piece_type,
@@ -1,6 +1,194 @@
 # app/controllers/tetris_pm_integration.py
 import time
+from collections import OrderedDict
 import numpy as np
+from app.models.tetris_piece import TetrisPiece
+
+try:
+    from numba import njit
+except ImportError:  # Numba is optional; fall back to NumPy below
+    njit = None
+
+try:
+    from scipy.optimize import linear_sum_assignment as _linear_sum_assignment
+except ImportError:  # SciPy is optional; fall back to greedy assignment
+    _linear_sum_assignment = None
+
+
+def _overlay_and_find_full_rows_np(grid, elem_xy):
+    """
+    Overlay PM elements onto the Tetris grid and flag the rows that are full.
+    
+    Args:
+        grid: Tetris grid as a 2D int8 NumPy array (0 = empty)
+        elem_xy: (N, 2) int32 array of PM element (x, y) coordinates
+        
+    Returns:
+        Boolean array with one entry per row, True where the row is full
+    """
+    grid_height, grid_width = grid.shape
+    occupied = grid != 0
+    
+    xs = elem_xy[:, 0]
+    ys = elem_xy[:, 1]
+    inside = (xs >= 0) & (xs < grid_width) & (ys >= 0) & (ys < grid_height)
+    occupied[ys[inside], xs[inside]] = True
+    
+    return occupied.all(axis=1)
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _overlay_and_find_full_rows(grid, elem_xy):
+        """Compiled single-pass version of _overlay_and_find_full_rows_np."""
+        grid_height, grid_width = grid.shape
+        combined = grid.copy()
+        
+        # Mark PM elements on empty cells
+        for k in range(elem_xy.shape[0]):
+            x = elem_xy[k, 0]
+            y = elem_xy[k, 1]
+            if 0 <= x < grid_width and 0 <= y < grid_height and combined[y, x] == 0:
+                combined[y, x] = 2
+        
+        # Flag rows without any empty cell
+        full = np.empty(grid_height, np.bool_)
+        for y in range(grid_height):
+            row_full = True
+            for x in range(grid_width):
+                if combined[y, x] == 0:
+                    row_full = False
+                    break
+            full[y] = row_full
+        return full
+    @njit(cache=True)
+    def _scan_grid_targets(grid, include_valleys, out_xy):
+        """
+        Collect near-complete row, hole and valley targets in one grid pass.
+        
+        Fuses _add_near_complete_row_targets, _add_support_structure_targets
+        and _heuristic_planning; targets may repeat across the three kinds.
+        
+        Args:
+            grid: Tetris grid as a 2D int8 NumPy array (0 = empty)
+            include_valleys: Whether to add heuristic valley targets
+            out_xy: (H*W + 2*H + W, 2) int32 buffer receiving (x, y) targets
+            
+        Returns:
+            Number of targets written to out_xy
+        """
+        grid_height, grid_width = grid.shape
+        first_filled = np.full(grid_width, grid_height, np.int64)
+        n = 0
+        
+        for y in range(grid_height):
+            empty_count = 0
+            for x in range(grid_width):
+                if grid[y, x] != 0:
+                    if first_filled[x] == grid_height:
+                        first_filled[x] = y
+                else:
+                    empty_count += 1
+                    
+                    # Hole: empty with a block above (skip bottom row)
+                    if first_filled[x] < y and y < grid_height - 1:
+                        out_xy[n, 0] = x
+                        out_xy[n, 1] = y
+                        n += 1
+            
+            # Nearly complete row: 1-2 empty cells (never the top row)
+            if y > 0 and 1 <= empty_count <= 2:
+                for x in range(grid_width):
+                    if grid[y, x] == 0:
+                        out_xy[n, 0] = x
+                        out_xy[n, 1] = y
+                        n += 1
+        
+        # Valleys: columns lower than both neighbours by more than one
+        if include_valleys:
+            for x in range(1, grid_width - 1):
+                current = grid_height - first_filled[x]
+                left = grid_height - first_filled[x - 1]
+                right = grid_height - first_filled[x + 1]
+                if current < min(left, right) - 1:
+                    target_y = grid_height - max(1, current + 1)
+                    if grid[target_y, x] == 0:
+                        out_xy[n, 0] = x
+                        out_xy[n, 1] = target_y
+                        n += 1
+        
+        return n
+else:
+    _overlay_and_find_full_rows = _overlay_and_find_full_rows_np
+    _scan_grid_targets = None
+
+
+if hasattr(np, 'bitwise_count'):
+    _popcount = np.bitwise_count
+else:  # NumPy < 2.0
+    def _popcount(words):
+        """Count set bits in each element of a uint64 array."""
+        return np.unpackbits(words.view(np.uint8)).reshape(words.shape[0], -1).sum(axis=1)
+
+# Shared result for updates that do nothing
+_NO_OP = {'action': 'none'}
+
+# Cell offsets of every piece rotation as (dxs, dys) arrays
+_PIECE_OFFSETS = {
+    shape_type: [(cells[:, 0].astype(np.intp), cells[:, 1].astype(np.intp)) for cells in table]
+    for shape_type, table in TetrisPiece.SHAPE_TABLES.items()
+}
+
+
+def _landing_placements(occupied, shape_type):
+    """
+    Enumerate where a piece can land when hard-dropped in each rotation and column.
+    
+    Args:
+        occupied: Boolean occupancy grid
+        shape_type: Letter of the piece to drop
+        
+    Yields:
+        (ys, xs) arrays of the landed piece cells
+    """
+    grid_height, grid_width = occupied.shape
+    
+    # First filled row in each column (grid_height when the column is empty)
+    first_filled = np.where(occupied.any(axis=0), occupied.argmax(axis=0), grid_height)
+    
+    for dxs, dys in _PIECE_OFFSETS[shape_type]:
+        for x in range(grid_width - int(dxs.max())):
+            xs = x + dxs
+            
+            # Drop until some cell rests on the column surface or the floor
+            y = int((first_filled[xs] - 1 - dys).min())
+            if y >= 0:
+                yield y + dys, xs
+
+
+def _place_piece(occupied, ys, xs):
+    """
+    Lock piece cells into a copy of the grid and clear completed rows.
+    
+    Returns:
+        Tuple of (resulting occupancy grid, number of lines cleared)
+    """
+    after = occupied.copy()
+    after[ys, xs] = True
+    
+    full = after.all(axis=1)
+    lines = int(np.count_nonzero(full))
+    if lines:
+        kept = after[~full]
+        after = np.zeros_like(after)
+        after[lines:] = kept
+        
+    return after, lines
+
+
+class _SearchTimeout(Exception):
+    """Raised inside Expectimax when the planning time budget runs out."""
+
 
 class TetrisPMIntegration:
     """
@@ -28,37 +216,102 @@ class TetrisPMIntegration:
         self.last_update_time = 0
         
         # Tracking metrics
-        self.target_positions = []  # Current target positions for PM elements
+        self.target_positions = {}  # Current target positions (dict used as an ordered set)
         self.planned_paths = {}  # Element ID -> planned path
         self.success_rate = 0.0  # Rate of successful target formations
         
+        # Struct-of-arrays view of the PM elements, reallocated only when
+        # the controller's element set changes (see _refresh_element_arrays)
+        self._elem_generation = None
+        self._elem_list = []
+        self._elem_xy = np.empty((0, 2), dtype=np.int32)
+        self._elem_txy = np.empty((0, 2), dtype=np.int32)
+        self._elem_has_target = np.empty(0, dtype=bool)
+        
+        # Tetris grid converted once per update() and shared by all helpers
+        self._grid_np = None
+        
+        # Row occupancy bitboard: bit x of _occ[y] is set when cell (x, y) is
+        # filled (grids up to 64 columns wide)
+        self._occ = None
+        self._heights = None  # Column heights of the cached grid
+        self._column_bits = np.left_shift(
+            np.uint64(1), np.arange(tetris_game.grid_width, dtype=np.uint64))
+        
+        # Output buffer for the fused grid scan kernel
+        grid_cells = tetris_game.grid_width * tetris_game.grid_height
+        self._scan_buf = np.empty(
+            (grid_cells + 2 * tetris_game.grid_height + tetris_game.grid_width, 2), dtype=np.int32)
+        
+        # Fingerprint of the last processed game state and its result,
+        # used to skip the whole pipeline on unchanged frames
+        self._last_state_key = None
+        self._last_formation_result = None
+        
         # AI parameters
         self.learning_enabled = False  # Whether learning is enabled
         self.use_expectimax = False  # Whether to use Expectimax for planning
         self.exploration_rate = 0.2  # Exploration rate for learning
+        self.search_time_fraction = 0.5  # Share of update_interval Expectimax may use
+        self._search_deadline = None
+        
+        # Board evaluation weights for Expectimax planning
+        self.weights = {
+            'height': -0.510066,  # Weight for cumulative height
+            'lines': 0.760666,    # Weight for completed lines
+            'holes': -0.35663,    # Weight for holes in the grid
+            'bumpiness': -0.184483  # Weight for bumpiness/contour
+        }
+        self.game_over_score = -1000.0  # Score for boards with no legal placement
+        
+        # Zobrist keys for hashing board occupancy, and a bounded
+        # transposition table of (hash, depth) -> expected value
+        rng = np.random.default_rng(0xC0FFEE)
+        self._zobrist = rng.integers(
+            0, 2**64, size=(tetris_game.grid_height, tetris_game.grid_width), dtype=np.uint64)
+        self._tt = OrderedDict()
+        self._tt_max_entries = 1 << 16
         
     def update(self, current_time):
         """
         Update the integration layer. Should be called on each game loop iteration.
         
         Args:
-            current_time: Current game time (from time.time())
+            current_time: Current game time (from time.perf_counter())
             
         Returns:
             Dict with update information
         """
         if self.tetris_game.paused or self.tetris_game.game_over:
-            return {'action': 'none'}
+            return _NO_OP
             
         # Only update PM at specified interval
         if current_time - self.last_update_time < self.update_interval:
-            return {'action': 'none'}
+            return _NO_OP
             
         self.last_update_time = current_time
         
         # Get current Tetris game state
         game_state = self.tetris_game.get_game_state()
         
+        self._sync_grid_state()
+        
+        # Nothing to re-plan if the board, the falling piece and the element
+        # set are exactly as they were on the last processed update
+        current_piece = game_state['current_piece']
+        state_key = (
+            self._grid_np.tobytes(),
+            game_state['current_piece_type'],
+            tuple(current_piece) if current_piece else None,
+            self.controller.generation
+        )
+        if state_key == self._last_state_key:
+            return {
+                'action': 'pm_update',
+                'moves': [],
+                'formations': self._last_formation_result
+            }
+        
         # Update PM target positions based on current game state
         self._update_target_positions(game_state)
         
@@ -68,12 +321,45 @@ class TetrisPMIntegration:
         # Check for successful formations
         formation_result = self._check_formations(game_state)
         
+        self._last_state_key = state_key
+        self._last_formation_result = formation_result
+        
         return {
             'action': 'pm_update',
             'moves': move_result.get('moves', []),
             'formations': formation_result
         }
     
+    def _sync_grid_state(self):
+        """
+        Bring the cached grid array, row bitboards and column heights up to
+        date with the Tetris grid.
+        
+        Only the cells changed since the last sync are applied; the state is
+        rebuilt from the packed grid bytes after a new game or a row clear.
+        """
+        game = self.tetris_game
+        dirty = game.consume_dirty()
+        
+        if dirty is None or self._grid_np is None:
+            self._grid_np = np.frombuffer(game.tetris_grid, dtype=np.int8).reshape(
+                game.grid_height, game.grid_width).copy()
+            filled = self._grid_np != 0
+            self._occ = filled.dot(self._column_bits)
+            self._heights = np.where(
+                filled.any(axis=0), game.grid_height - filled.argmax(axis=0), 0)
+            return
+        
+        for x, y, value in dirty:
+            self._grid_np[y, x] = value
+            if value:
+                self._occ[y] |= self._column_bits[x]
+                self._heights[x] = max(self._heights[x], game.grid_height - y)
+            else:
+                self._occ[y] &= ~self._column_bits[x]
+                column = np.flatnonzero(self._grid_np[:, x])
+                self._heights[x] = game.grid_height - column[0] if column.size else 0
+    
     def _update_target_positions(self, game_state):
         """
         Update the target positions for programmable matter elements
@@ -83,98 +369,127 @@ class TetrisPMIntegration:
             game_state: Current Tetris game state
         """
         # Clear previous targets
-        self.target_positions = []
+        self.target_positions = {}
+        
+        grid_np = self._grid_np
         
         # Strategies for setting target positions:
         
-        # 1. Prioritize completing rows that are nearly full
-        self._add_near_complete_row_targets(game_state)
+        if _scan_grid_targets is not None:
+            # 1, 3 and heuristic 4 below in a single compiled grid pass
+            self._add_grid_scan_targets(grid_np)
+        else:
+            # 1. Prioritize completing rows that are nearly full
+            self._add_near_complete_row_targets(grid_np)
+            
+            # 3. Add stability/support structure targets
+            self._add_support_structure_targets(grid_np)
         
         # 2. Position under the current falling piece
-        self._add_current_piece_targets(game_state)
-        
-        # 3. Add stability/support structure targets
-        self._add_support_structure_targets(game_state)
+        self._add_current_piece_targets(game_state, grid_np)
         
         # 4. Position for future pieces (if planning ahead)
         if self.planning_depth > 0:
-            self._add_future_piece_targets(game_state)
+            self._add_future_piece_targets(game_state, grid_np)
         
         # Finalize and assign target positions to elements
         self._assign_targets_to_elements()
     
-    def _add_near_complete_row_targets(self, game_state):
+    def _add_grid_scan_targets(self, grid_np):
         """
-        Add targets to complete rows that are nearly full.
+        Add near-complete row, hole and heuristic valley targets using the
+        fused _scan_grid_targets kernel.
         
         Args:
-            game_state: Current Tetris game state
+            grid_np: Current Tetris grid as a 2D NumPy array
+        """
+        include_valleys = self.planning_depth > 0 and not self.use_expectimax
+        count = _scan_grid_targets(grid_np, include_valleys, self._scan_buf)
+        self.target_positions.update(dict.fromkeys(map(tuple, self._scan_buf[:count].tolist())))
+    
+    def _add_near_complete_row_targets(self, grid_np):
         """
-        grid = game_state['grid']
+        Add targets to complete rows that are nearly full.
         
-        # Check each row from bottom to top
-        for y in range(len(grid) - 1, 0, -1):
-            row = grid[y]
-            
-            # Count empty cells in this row
-            empty_count = row.count(0)
-            
-            # If row is nearly complete (1-2 empty cells), add targets
-            if 0 < empty_count <= 2:
-                for x, cell in enumerate(row):
-                    if cell == 0:
-                        self.target_positions.append((x, y))
+        Args:
+            grid_np: Current Tetris grid as a 2D NumPy array
+        """
+        grid_width = grid_np.shape[1]
+        
+        # Count filled cells per row with a single popcount of the row
+        # bitboard words kept by _sync_grid_state
+        filled_counts = _popcount(self._occ)
+        
+        # Rows are nearly complete when they have 1-2 empty cells
+        row_mask = (filled_counts == grid_width - 1) | (filled_counts == grid_width - 2)
+        
+        # The top row is never a completion target
+        row_mask[0] = False
+        
+        # Walk the empty bits of each selected row, lowest bit first
+        full_row = (1 << grid_width) - 1
+        for y in np.flatnonzero(row_mask).tolist():
+            empty_bits = ~int(self._occ[y]) & full_row
+            while empty_bits:
+                lowest = empty_bits & -empty_bits
+                self.target_positions[(lowest.bit_length() - 1, y)] = None
+                empty_bits ^= lowest
     
-    def _add_current_piece_targets(self, game_state):
+    def _add_current_piece_targets(self, game_state, grid_np):
         """
         Add targets to position under the current falling piece.
         
         Args:
             game_state: Current Tetris game state
+            grid_np: Current Tetris grid as a 2D NumPy array
         """
-        current_piece = game_state.get('current_piece')
         shadow_positions = game_state.get('shadow_positions')
+        grid_height = grid_np.shape[0]
         
         if shadow_positions:
             # Add positions below the shadow (landing) positions
             for x, y in shadow_positions:
                 # Check if position below is empty and valid
-                if (y + 1 < len(game_state['grid']) and 
-                    game_state['grid'][y + 1][x] == 0):
-                    self.target_positions.append((x, y + 1))
+                if y + 1 < grid_height and grid_np[y + 1, x] == 0:
+                    self.target_positions[(x, y + 1)] = None
     
-    def _add_support_structure_targets(self, game_state):
+    def _add_support_structure_targets(self, grid_np):
         """
         Add targets to create support structures for stability.
         
         Args:
-            game_state: Current Tetris game state
+            grid_np: Current Tetris grid as a 2D NumPy array
         """
-        grid = game_state['grid']
-        
-        # Look for patterns where support would be beneficial
-        for y in range(len(grid) - 2, 0, -1):  # Skip bottom row
-            for x in range(len(grid[y])):
-                # Check for "holes" (empty cells with non-empty cells above)
-                if grid[y][x] == 0:
-                    # Check if there's a tetris block above
-                    has_block_above = False
-                    for check_y in range(y - 1, -1, -1):
-                        if grid[check_y][x] != 0:
-                            has_block_above = True
-                            break
-                    
-                    if has_block_above:
-                        # This is a hole, add a target here
-                        self.target_positions.append((x, y))
+        nonzero = grid_np != 0
+        
+        # Columns without any block cannot have holes; scan only the rest
+        active_cols = np.flatnonzero(nonzero.any(axis=0))
+        if active_cols.size == 0:
+            return
+        nonzero = nonzero[:, active_cols]
+        
+        # A cell has a block above it if any cell higher in its column is
+        # filled; the running column count shifted down one row gives that
+        filled_above = np.cumsum(nonzero, axis=0)
+        has_block_above = np.zeros_like(nonzero)
+        has_block_above[1:] = filled_above[:-1] > 0
+        
+        # "Holes" are empty cells with a block above (skip bottom row)
+        holes = ~nonzero & has_block_above
+        holes[-1] = False
+        
+        ys, cols = np.where(holes)
+        xs = active_cols[cols]
+        self.target_positions.update(dict.fromkeys(zip(xs.tolist(), ys.tolist())))
     
-    def _add_future_piece_targets(self, game_state):
+    def _add_future_piece_targets(self, game_state, grid_np):
         """
         Add targets based on planning for future pieces.
         More advanced - implements look-ahead planning.
         
         Args:
             game_state: Current Tetris game state
+            grid_np: Current Tetris grid as a 2D NumPy array
         """
         # This would implement more advanced planning algorithms
         # like Expectimax or Monte Carlo Tree Search
@@ -182,147 +497,251 @@ class TetrisPMIntegration:
         if self.use_expectimax:
             # Example placeholder for Expectimax planning
             future_targets = self._expectimax_planning(game_state)
-            self.target_positions.extend(future_targets)
-        else:
-            # Simpler heuristic planning
-            future_targets = self._heuristic_planning(game_state)
-            self.target_positions.extend(future_targets)
+            self.target_positions.update(dict.fromkeys(future_targets))
+        elif _scan_grid_targets is None:
+            # Simpler heuristic planning (otherwise done by the fused grid scan)
+            future_targets = self._heuristic_planning(grid_np)
+            self.target_positions.update(dict.fromkeys(future_targets))
     
     def _expectimax_planning(self, game_state):
         """
         Implement Expectimax planning for future pieces.
         
+        Searches placements of the known next piece, averaging over uniformly
+        random pieces after it, and targets the empty cells that would
+        support the best placement.
+        
         Args:
             game_state: Current Tetris game state
             
         Returns:
             List of target positions based on Expectimax planning
         """
-        # This is a placeholder for actual Expectimax implementation
-        # In a real implementation, this would model possible future
-        # pieces and their optimal placements
+        next_piece = game_state.get('next_piece')
+        if next_piece is None:
+            return []
+            
+        # Plan on the board as it will be once the current piece lands
+        occupied = self._grid_np != 0
+        grid_height, grid_width = occupied.shape
+        for x, y in game_state.get('shadow_positions') or []:
+            if 0 <= x < grid_width and 0 <= y < grid_height:
+                occupied[y, x] = True
+        
+        # Iterative deepening: search one more piece ahead while the time
+        # budget allows and keep the result of the deepest finished search.
+        # Depth 1 never checks the deadline, so there is always a result.
+        budget = self.update_interval * self.search_time_fraction
+        self._search_deadline = time.perf_counter() + budget
+        
+        best_cells = None
+        for depth in range(1, self.planning_depth + 1):
+            try:
+                best_cells = self._expectimax_best_placement(occupied, next_piece, depth)
+            except _SearchTimeout:
+                break
+            if time.perf_counter() >= self._search_deadline:
+                break
+                
+        if best_cells is None:
+            return []
+            
+        # Support the placement from below where it would overhang empty cells
+        ys, xs = best_cells
+        below = ys + 1
+        inside = below < grid_height
+        xs, below = xs[inside], below[inside]
+        support = ~occupied[below, xs]
+        targets = set(zip(xs[support].tolist(), below[support].tolist()))
+        targets -= set(zip(best_cells[1].tolist(), best_cells[0].tolist()))
+        
+        return list(targets)
+    
+    def _expectimax_best_placement(self, occupied, shape_type, depth):
+        """
+        Find the best landing cells for a known piece.
         
-        return []  # Placeholder
+        Args:
+            occupied: Boolean occupancy grid
+            shape_type: Letter of the piece to place
+            depth: Number of pieces to look ahead, including this one
+            
+        Returns:
+            (ys, xs) arrays of the best placement, or None if none is legal
+        """
+        best_cells = None
+        best_value = float('-inf')
+        for ys, xs in _landing_placements(occupied, shape_type):
+            after, lines = _place_piece(occupied, ys, xs)
+            value = self.weights['lines'] * lines + self._expectimax_value(after, depth - 1)
+            if value > best_value:
+                best_value = value
+                best_cells = (ys, xs)
+                
+        return best_cells
+    
+    def _expectimax_value(self, occupied, depth):
+        """
+        Expected score of a board with `depth` random pieces still to place.
+        
+        Args:
+            occupied: Boolean occupancy grid
+            depth: Number of random pieces to look ahead
+            
+        Returns:
+            Expected board score under optimal placements
+        """
+        if depth <= 0:
+            return self._evaluate_board(occupied)
+            
+        # Probe the transposition table
+        key = (self._zobrist_hash(occupied), depth)
+        cached = self._tt.get(key)
+        if cached is not None:
+            self._tt.move_to_end(key)
+            return cached
+            
+        if time.perf_counter() >= self._search_deadline:
+            raise _SearchTimeout()
+        
+        # Chance node: every piece type is equally likely
+        total = 0.0
+        for shape_type in TetrisPiece.SHAPES:
+            best = self.game_over_score
+            for ys, xs in _landing_placements(occupied, shape_type):
+                after, lines = _place_piece(occupied, ys, xs)
+                value = self.weights['lines'] * lines + self._expectimax_value(after, depth - 1)
+                best = max(best, value)
+            total += best
+        value = total / len(TetrisPiece.SHAPES)
+        
+        # Store, evicting the least recently used entry when full
+        self._tt[key] = value
+        if len(self._tt) > self._tt_max_entries:
+            self._tt.popitem(last=False)
+            
+        return value
+    
+    def _zobrist_hash(self, occupied):
+        """Hash a boolean occupancy grid by XOR-ing the keys of filled cells."""
+        return int(np.bitwise_xor.reduce(self._zobrist[occupied]))
     
-    def _heuristic_planning(self, game_state):
+    def _evaluate_board(self, occupied):
+        """
+        Score a board by aggregate height, holes and bumpiness.
+        
+        Args:
+            occupied: Boolean occupancy grid
+            
+        Returns:
+            Weighted board score (higher is better)
+        """
+        grid_height = occupied.shape[0]
+        heights = np.where(occupied.any(axis=0), grid_height - occupied.argmax(axis=0), 0)
+        
+        aggregate_height = int(heights.sum())
+        
+        # Every empty cell below a column's top is a hole
+        holes = aggregate_height - int(np.count_nonzero(occupied))
+        bumpiness = int(np.abs(np.diff(heights)).sum())
+        
+        return (self.weights['height'] * aggregate_height +
+                self.weights['holes'] * holes +
+                self.weights['bumpiness'] * bumpiness)
+    
+    def _heuristic_planning(self, grid_np):
         """
         Implement simpler heuristic planning for future pieces.
         
         Args:
-            game_state: Current Tetris game state
+            grid_np: Current Tetris grid as a 2D NumPy array
             
         Returns:
             List of target positions based on heuristic planning
         """
         # Simple heuristic: try to create flat surfaces
-        grid = game_state['grid']
-        targets = []
+        grid_height = grid_np.shape[0]
+        heights = self._heights
         
         # Find "valleys" (cells with higher columns on both sides)
-        for x in range(1, len(grid[0]) - 1):
-            height_left = 0
-            height_right = 0
-            height_current = 0
-            
-            # Calculate heights
-            for y in range(len(grid)):
-                if grid[y][x-1] != 0:
-                    height_left = len(grid) - y
-                    break
-                    
-            for y in range(len(grid)):
-                if grid[y][x+1] != 0:
-                    height_right = len(grid) - y
-                    break
-                    
-            for y in range(len(grid)):
-                if grid[y][x] != 0:
-                    height_current = len(grid) - y
-                    break
-                    
-            # If this is a valley, add target
-            if height_current < min(height_left, height_right) - 1:
-                target_y = len(grid) - max(1, height_current + 1)
-                if target_y < len(grid) and grid[target_y][x] == 0:
-                    targets.append((x, target_y))
-                    
-        return targets
+        current = heights[1:-1]
+        valleys = current < np.minimum(heights[:-2], heights[2:]) - 1
+        xs = np.nonzero(valleys)[0] + 1
+        
+        # Target the empty cell just above the valley floor
+        target_ys = grid_height - np.maximum(1, heights[xs] + 1)
+        empty = grid_np[target_ys, xs] == 0
+        
+        return list(zip(xs[empty].tolist(), target_ys[empty].tolist()))
     
     def _assign_targets_to_elements(self):
         """
         Assign target positions to PM elements.
         Uses a greedy algorithm to minimize total distance.
         """
-        # Remove duplicates from target positions
-        unique_targets = list(set(self.target_positions))
+        # Target positions are deduplicated on insertion, in a stable order
+        unique_targets = list(self.target_positions)
         
-        # Get all available PM elements
-        elements = list(self.controller.elements.values())
+        # Get all available PM elements and their current coordinates
+        self._refresh_element_arrays()
+        elements = self._elem_list
         
         # If no targets or elements, nothing to do
         if not unique_targets or not elements:
             return
             
-        # Create a cost matrix for assignment
-        cost_matrix = np.zeros((len(elements), len(unique_targets)))
-        
-        for i, element in enumerate(elements):
-            for j, (tx, ty) in enumerate(unique_targets):
-                # Manhattan distance as cost
-                cost_matrix[i, j] = abs(element.x - tx) + abs(element.y - ty)
+        # Create a cost matrix for assignment (Manhattan distance as cost)
+        ex = self._elem_xy[:, 0]
+        ey = self._elem_xy[:, 1]
+        tx, ty = np.array(unique_targets, dtype=np.int32).T
+        
+        # Rectangular int32 matrix (costs are small grid distances), filled
+        # in place to avoid float64 and full-size temporaries
+        cost_matrix = np.empty((len(elements), len(unique_targets)), dtype=np.int32)
+        dy = np.empty_like(cost_matrix)
+        np.subtract(ex[:, None], tx[None, :], out=cost_matrix)
+        np.abs(cost_matrix, out=cost_matrix)
+        np.subtract(ey[:, None], ty[None, :], out=dy)
+        np.abs(dy, out=dy)
+        cost_matrix += dy
                 
         # Use the Hungarian algorithm for optimal assignment
-        try:
-            from scipy.optimize import linear_sum_assignment
-            row_ind, col_ind = linear_sum_assignment(cost_matrix)
+        if _linear_sum_assignment is not None:
+            row_ind, col_ind = _linear_sum_assignment(cost_matrix)
             
             # Assign targets based on the solution
-            for i, j in zip(row_ind, col_ind):
-                if j < len(unique_targets):  # Safety check
-                    tx, ty = unique_targets[j]
-                    elements[i].set_target(tx, ty)
-        except ImportError:
+            for i, j in zip(row_ind.tolist(), col_ind.tolist()):
+                tx, ty = unique_targets[j]
+                elements[i].set_target(tx, ty)
+        else:
             # Fallback to greedy assignment if scipy not available
-            self._greedy_target_assignment(elements, unique_targets)
+            self._greedy_target_assignment(elements, unique_targets, cost_matrix)
     
-    def _greedy_target_assignment(self, elements, targets):
+    def _greedy_target_assignment(self, elements, targets, cost_matrix):
         """
         Fallback greedy algorithm for target assignment.
         
+        Repeatedly assigns the closest remaining (element, target) pair,
+        masking out the chosen row and column of the cost matrix.
+        
         Args:
             elements: List of PM elements
             targets: List of target positions
+            cost_matrix: (elements x targets) Manhattan distance matrix
         """
-        # Sort elements by distance to closest target
-        element_distances = []
-        for element in elements:
-            min_dist = float('inf')
-            for tx, ty in targets:
-                dist = abs(element.x - tx) + abs(element.y - ty)
-                min_dist = min(min_dist, dist)
-            element_distances.append((element, min_dist))
-            
-        # Sort by minimum distance (ascending)
-        element_distances.sort(key=lambda x: x[1])
+        cost = cost_matrix.astype(np.float64)
+        num_targets = cost.shape[1]
         
-        # Assign targets
-        remaining_targets = targets.copy()
-        for element, _ in element_distances:
-            if not remaining_targets:
+        for _ in range(min(len(elements), num_targets)):
+            i, j = divmod(int(cost.argmin()), num_targets)
+            if cost[i, j] == np.inf:
                 break
                 
-            # Find closest target
-            closest_target = None
-            min_dist = float('inf')
-            for tx, ty in remaining_targets:
-                dist = abs(element.x - tx) + abs(element.y - ty)
-                if dist < min_dist:
-                    min_dist = dist
-                    closest_target = (tx, ty)
-                    
-            if closest_target:
-                element.set_target(*closest_target)
-                remaining_targets.remove(closest_target)
+            elements[i].set_target(*targets[j])
+            
+            # Element i and target j are taken
+            cost[i, :] = np.inf
+            cost[:, j] = np.inf
     
     def _plan_and_execute_moves(self, game_state):
         """
@@ -370,15 +789,13 @@ class TetrisPMIntegration:
         Returns:
             Dict with formation results
         """
-        # Count how many elements reached their targets
-        elements_at_target = 0
-        elements_with_targets = 0
+        self._refresh_element_arrays()
         
-        for element in self.controller.elements.values():
-            if element.has_target():
-                elements_with_targets += 1
-                if element.x == element.target_x and element.y == element.target_y:
-                    elements_at_target += 1
+        # Count how many elements reached their targets
+        has_target = self._elem_has_target
+        at_target = has_target & (self._elem_xy == self._elem_txy).all(axis=1)
+        elements_with_targets = int(np.count_nonzero(has_target))
+        elements_at_target = int(np.count_nonzero(at_target))
         
         # Calculate success rate
         if elements_with_targets > 0:
@@ -397,6 +814,35 @@ class TetrisPMIntegration:
             'rows_formed': rows_formed
         }
     
+    def _refresh_element_arrays(self):
+        """
+        Refresh the struct-of-arrays copy of the PM element state.
+        
+        The arrays are reallocated only when the controller's element set
+        changes; otherwise the current coordinates are written in place.
+        """
+        if self.controller.generation != self._elem_generation:
+            self._elem_generation = self.controller.generation
+            self._elem_list = list(self.controller.elements.values())
+            count = len(self._elem_list)
+            self._elem_xy = np.empty((count, 2), dtype=np.int32)
+            self._elem_txy = np.empty((count, 2), dtype=np.int32)
+            self._elem_has_target = np.empty(count, dtype=bool)
+        
+        xy = self._elem_xy
+        txy = self._elem_txy
+        has_target = self._elem_has_target
+        for i, element in enumerate(self._elem_list):
+            xy[i, 0] = element.x
+            xy[i, 1] = element.y
+            if element.has_target():
+                has_target[i] = True
+                txy[i, 0] = element.target_x
+                txy[i, 1] = element.target_y
+            else:
+                has_target[i] = False
+                txy[i] = -1
+    
     def _check_for_complete_rows(self, game_state):
         """
         Check if PM elements have formed complete rows.
@@ -407,24 +853,10 @@ class TetrisPMIntegration:
         Returns:
             List of row indices that are complete
         """
-        tetris_grid = game_state['grid']
-        grid_width = len(tetris_grid[0])
-        grid_height = len(tetris_grid)
-        
-        # Create a copy of the Tetris grid with PM elements added
-        combined_grid = [row.copy() for row in tetris_grid]
-        
-        # Add PM elements to the grid
-        for element in self.controller.elements.values():
-            if 0 <= element.x < grid_width and 0 <= element.y < grid_height:
-                if combined_grid[element.y][element.x] == 0:  # Only if space is empty
-                    combined_grid[element.y][element.x] = 'PM'  # Mark as PM element
-        
-        # Check for complete rows
-        complete_rows = []
-        for y in range(grid_height):
-            if all(cell != 0 for cell in combined_grid[y]):
-                complete_rows.append(y)
+        # Check for complete rows on the Tetris grid with PM elements added
+        # (element coordinates were refreshed by _check_formations)
+        full_rows = _overlay_and_find_full_rows(self._grid_np, self._elem_xy)
+        complete_rows = np.flatnonzero(full_rows).tolist()
                 
         # If there are complete rows, update the Tetris game
         if complete_rows:
@@ -442,14 +874,13 @@ class TetrisPMIntegration:
             # Update lines cleared
             self.tetris_game.lines_cleared += len(complete_rows)
             
-            # Clear the rows in the Tetris grid
-            for y in sorted(complete_rows, reverse=True):
-                # Move rows down
-                for row in range(y, 0, -1):
-                    self.tetris_game.tetris_grid[row] = self.tetris_game.tetris_grid[row - 1].copy()
-                    
-                # Empty the top row
-                self.tetris_game.tetris_grid[0] = [0 for _ in range(grid_width)]
+            # Clear the rows in the Tetris grid: keep the surviving rows in
+            # order and stack them beneath freshly emptied rows in one copy
+            keep = ~full_rows
+            cleared = np.zeros_like(self._grid_np)
+            cleared[len(complete_rows):] = self._grid_np[keep]
+            self.tetris_game.replace_grid(cleared.tobytes())
+            self._grid_np = cleared
                 
             # Special case: If 4 rows, count as a Tetris
             if len(complete_rows) == 4:
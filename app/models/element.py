@@ -1,5 +1,9 @@
 class Element:
     """Represents a programmable matter element with enhanced capabilities for distributed control."""
+    __slots__ = ('id', 'x', 'y', 'target_x', 'target_y',
+                 'failed_attempts', 'last_positions', 'last_distances', 'stuck_count',
+                 'priority', 'temp_target', 'is_in_deadlock_resolution')
+    
     def __init__(self, element_id, x, y):
         self.id = element_id
         self.x = x
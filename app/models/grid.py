@@ -18,6 +18,9 @@ class Grid:
         self.grid[height-1, :] = WALL
         self.grid[:, 0] = WALL
         self.grid[:, width-1] = WALL
+        self.version = 0  # Bumped whenever a cell changes
+        # 1 where an element sits, kept in step with every add/remove/move
+        self.occupancy = np.zeros((height, width), dtype=np.uint8)
     
     def clear_grid(self):
         """Clear the grid, preserving walls."""
@@ -25,6 +28,8 @@ class Grid:
             for x in range(self.width):
                 if self.grid[y, x] != WALL:
                     self.grid[y, x] = EMPTY
+        self.occupancy[:] = 0
+        self.version += 1
     
     def add_element(self, element):
         """Add an element to the grid."""
@@ -38,6 +43,8 @@ class Grid:
                 return False
                 
             self.grid[element.y, element.x] = ELEMENT
+            self.occupancy[element.y, element.x] = 1
+            self.version += 1
             return True
         return False
     
@@ -47,6 +54,8 @@ class Grid:
             # Only clear the position if it actually contains an element
             if self.grid[element.y, element.x] == ELEMENT:
                 self.grid[element.y, element.x] = EMPTY
+                self.occupancy[element.y, element.x] = 0
+                self.version += 1
                 return True
             else:
                 print(f"WARNING: Attempted to remove element from position that doesn't contain an element ({element.x}, {element.y})")
@@ -82,6 +91,9 @@ class Grid:
         # Execute the move
         self.grid[element.y, element.x] = EMPTY
         self.grid[new_y, new_x] = ELEMENT
+        self.occupancy[element.y, element.x] = 0
+        self.occupancy[new_y, new_x] = 1
+        self.version += 1
         
         # Update element coordinates
         element.x = new_x
@@ -125,6 +137,7 @@ class Grid:
         """Mark a position as a target."""
         if self.is_playable_position(x, y):
             self.grid[y, x] = TARGET
+            self.version += 1
             return True
         return False
     
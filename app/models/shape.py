@@ -1,20 +1,36 @@
 import numpy as np
 import math 
+from functools import lru_cache
+
+from app.models.grid import WALL
+
+# Print generated positions for debugging
+DEBUG = False
+
+# Fixed heart positions (12 blocks) as [row, col], exactly as in the JavaScript code
+_HEART_TEMPLATE = np.array([
+    (2, 3), (2, 6),                  # Top curves (2)
+    (3, 2), (3, 4), (3, 5), (3, 7),  # Upper middle row (4)
+    (4, 2), (4, 7),                  # Middle section (2)
+    (5, 3), (5, 6),                  # Bottom curves start (2)
+    (6, 4), (6, 5),                  # Bottom middle (2)
+])
+
 class ShapeGenerator:
-    """Generates target positions for different shapes."""
+    """
+    Generates target positions for different shapes.
+    
+    Positions are returned as (N, 2) int32 arrays of (x, y) rows.
+    """
     @staticmethod
     def generate_shape(shape_type, num_elements, grid_width, grid_height):
-        """Generate target positions for the specified shape."""
-        if shape_type == "square":
-            return ShapeGenerator.generate_square(num_elements, grid_width, grid_height)
-        elif shape_type == "circle":
-            return ShapeGenerator.generate_circle(num_elements, grid_width, grid_height)
-        elif shape_type == "triangle":
-            return ShapeGenerator.generate_triangle(num_elements, grid_width, grid_height)
-        elif shape_type == "heart":
-            return ShapeGenerator.generate_heart(num_elements, grid_width, grid_height)
-        else:
-            raise ValueError(f"Unknown shape type: {shape_type}")
+        """
+        Generate target positions for the specified shape.
+        
+        Shapes are deterministic, so results are cached per (shape, count,
+        grid size) and returned as read-only arrays.
+        """
+        return _generate_shape_cached(shape_type, num_elements, grid_width, grid_height)
         
     @staticmethod
     def generate_square(num_elements, grid_width, grid_height):
@@ -27,30 +43,23 @@ class ShapeGenerator:
         start_y = (grid_height - side_length) // 2
         
         # Generate positions in (x,y) format but in a way that matches
-        # the frontend's [row, col] visual layout
-        positions = []
-        for y in range(start_y, start_y + side_length):
-            for x in range(start_x, start_x + side_length):
-                # Note: We store coordinates as (x,y) where x=col, y=row
-                positions.append((x, y))
-                if len(positions) >= num_elements:
-                    break
-            if len(positions) >= num_elements:
-                break
+        # the frontend's [row, col] visual layout: row-major over the square,
+        # built in one shot and cut to the requested count
+        # Note: We store coordinates as (x,y) where x=col, y=row
+        ys, xs = np.mgrid[start_y:start_y + side_length, start_x:start_x + side_length]
+        positions = np.stack([xs.ravel(), ys.ravel()], axis=1)[:num_elements].astype(np.int32)
 
         # Debug output to see generated positions
-        print(f"SQUARE POSITIONS GENERATED (x,y format):")
-        for i, (x, y) in enumerate(positions):
-            print(f"  Position {i}: ({x},{y})")
+        if DEBUG:
+            print(f"SQUARE POSITIONS GENERATED (x,y format):")
+            for i, (x, y) in enumerate(positions):
+                print(f"  Position {i}: ({x},{y})")
             
         return positions
     
     @staticmethod
     def generate_circle(num_elements, grid_width, grid_height):
         """Generate a circle shape using a predefined pattern of agents per row."""
-        positions = []
-        remaining = num_elements
-        
         # Base configuration for the circle shape
         base_agents = 20
         
@@ -58,7 +67,7 @@ class ShapeGenerator:
         row_pattern = [2, 4, 4, 4, 4, 2]
         
         # Define which rows should have gaps in the middle
-        rows_with_gaps = [2, 3]
+        rows_with_gaps = {2, 3}
         
         # If we have additional agents beyond the base configuration,
         # adjust the row pattern to add 2 agents per row
@@ -90,73 +99,49 @@ class ShapeGenerator:
         # Calculate vertical offset to center the pattern
         vertical_offset = (grid_height - len(row_pattern)) // 2
         
-        # Place agents according to the pattern
-        for row_idx, agents_in_row in enumerate(row_pattern):
-            # If we've placed all agents, stop
-            if remaining <= 0:
-                break
-                
-            # Calculate actual row position with offset
-            actual_row = row_idx + vertical_offset
-                
-            # If we've reached the bottom of the grid, stop
-            if actual_row >= grid_height:
-                break
-                
-            # Calculate how many agents to place in this row
-            agents_to_place = min(agents_in_row, remaining)
-            
-            # For rows that need a gap in the middle
-            if row_idx in rows_with_gaps:
-                # Calculate how many agents to place on each side of the gap
-                agents_per_side = agents_in_row // 2
-                
-                # Calculate the size of the gap (always maintain 2 empty cells in the middle)
-                gap_size = 2
-                
-                # Calculate the starting column for the left side
-                left_start = (grid_width - (agents_per_side * 2 + gap_size)) // 2
-                
-                # Left side agents
-                for i in range(agents_per_side):
-                    if remaining <= 0:
-                        break
-                    positions.append((left_start + i, actual_row))
-                    remaining -= 1
-                
-                # Right side agents (after the gap)
-                right_start = left_start + agents_per_side + gap_size
-                for i in range(agents_per_side):
-                    if remaining <= 0:
-                        break
-                    positions.append((right_start + i, actual_row))
-                    remaining -= 1
-            else:
-                # For other rows, center the agents
-                start_col = (grid_width - agents_in_row) // 2
-                for i in range(agents_to_place):
-                    if remaining <= 0:
-                        break
-                    positions.append((start_col + i, actual_row))
-                    remaining -= 1
+        # Describe every row as runs of consecutive columns: one centered run
+        # per row, or two runs around a 2-cell gap for the gap rows
+        row_counts = np.array(row_pattern)
+        gap_rows = np.isin(np.arange(len(row_pattern)), list(rows_with_gaps))
+        agents_per_side = row_counts // 2
+        gap_size = 2
+        left_start = (grid_width - (agents_per_side * 2 + gap_size)) // 2
         
-        # If we still have agents left to place, add them in rows below the pattern
-        if remaining > 0:
-            current_row = vertical_offset + len(row_pattern)
-            
-            while remaining > 0 and current_row < grid_height:
-                # Place up to grid_width agents per row
-                agents_to_place = min(grid_width, remaining)
-                start_col = (grid_width - agents_to_place) // 2
-                
-                for i in range(agents_to_place):
-                    positions.append((start_col + i, current_row))
-                    remaining -= 1
-                    
-                current_row += 1
+        run_rows = np.concatenate([np.flatnonzero(~gap_rows), np.flatnonzero(gap_rows).repeat(2)])
+        run_starts = np.concatenate([
+            (grid_width - row_counts[~gap_rows]) // 2,
+            np.stack([left_start, left_start + agents_per_side + gap_size], axis=1)[gap_rows].ravel()
+        ])
+        run_lengths = np.concatenate([row_counts[~gap_rows], agents_per_side[gap_rows].repeat(2)])
+        
+        # Keep the runs in row order and drop rows past the bottom of the grid
+        order = np.argsort(run_rows, kind='stable')
+        run_rows = run_rows[order] + vertical_offset
+        run_starts = run_starts[order]
+        run_lengths = run_lengths[order]
+        on_grid = run_rows < grid_height
+        run_rows, run_starts, run_lengths = run_rows[on_grid], run_starts[on_grid], run_lengths[on_grid]
+        
+        # If we still have agents left to place, add them in rows below the
+        # pattern, up to grid_width agents per row
+        remaining = num_elements - int(run_lengths.sum())
+        if remaining > 0 and grid_width > 0:
+            first_row = vertical_offset + len(row_pattern)
+            extra_lengths = np.full(-(-remaining // grid_width), grid_width)
+            extra_lengths[-1] = remaining - grid_width * (len(extra_lengths) - 1)
+            extra_rows = first_row + np.arange(len(extra_lengths))
+            on_grid = extra_rows < grid_height
+            run_rows = np.concatenate([run_rows, extra_rows[on_grid]])
+            run_starts = np.concatenate([run_starts, ((grid_width - extra_lengths) // 2)[on_grid]])
+            run_lengths = np.concatenate([run_lengths, extra_lengths[on_grid]])
+        
+        # Expand the runs into (x, y) positions in one pass
+        run_offsets = np.cumsum(run_lengths) - run_lengths
+        xs = np.arange(int(run_lengths.sum())) + np.repeat(run_starts - run_offsets, run_lengths)
+        ys = np.repeat(run_rows, run_lengths)
         
         # Ensure we don't exceed the requested number of elements
-        return positions[:num_elements]
+        return np.stack([xs, ys], axis=1)[:num_elements].astype(np.int32)
     
 
     @staticmethod
@@ -166,8 +151,10 @@ class ShapeGenerator:
         where each row has 2 more agents than the previous row.
         Formula: r(r + 1) ≤ num_agents, where r is the number of rows.
         """
-        r = 0
-        while r * (r + 1) < num_agents:
+        # Smallest r with r(r + 1) >= num_agents: start from the largest
+        # r with r(r + 1) <= num_agents, using exact integer square roots
+        r = (math.isqrt(1 + 4 * max(num_agents, 0)) - 1) // 2
+        if r * (r + 1) < num_agents:
             r += 1
         return r + 1  # Add 1 for buffer    
 
@@ -177,11 +164,10 @@ class ShapeGenerator:
         Generate a triangle shape where each row has 2 more elements than the previous row.
         The top row starts with 2 elements.
         """
-        positions = []
-        
         # Calculate the number of rows needed for the triangle
-        # Using the formula r(r+1) ≤ num_agents where r is the number of rows
-        r = int((-1 + math.sqrt(1 + 4 * num_elements)) / 2)
+        # Using the formula r(r+1) ≤ num_agents where r is the number of rows,
+        # solved exactly with an integer square root
+        r = (math.isqrt(1 + 4 * num_elements) - 1) // 2
         
         # If we can't even fill the first row with 2 agents, adjust
         if r < 1 and num_elements >= 2:
@@ -193,32 +179,25 @@ class ShapeGenerator:
         # Remaining elements for the last partial row (if any)
         remaining_elements = num_elements - elements_in_complete_rows
         
-        # Determine elements per row (starting from the top with 2 elements)
-        elements_per_row = []
-        for i in range(r):
-            elements_per_row.append(2 * (i + 1))  # 2, 4, 6, 8, ...
-        
-        # Add the last partial row if needed
+        # Determine elements per row (starting from the top with 2 elements),
+        # adding the last partial row if needed
+        elements_per_row = 2 * np.arange(1, r + 1)  # 2, 4, 6, 8, ...
         if remaining_elements > 0:
-            elements_per_row.append(remaining_elements)
-        
-        # Generate positions for each row
-        for row, num_in_row in enumerate(elements_per_row):
-            # Center the elements in this row
-            start_col = (grid_width - num_in_row) // 2
-            
-            # Add positions for this row
-            for col in range(num_in_row):
-                positions.append((start_col + col, row))
+            elements_per_row = np.append(elements_per_row, remaining_elements)
         
-        # Adjust positions to be centered in the grid vertically
+        # Center the triangle in the grid vertically
         total_rows = len(elements_per_row)
         vertical_offset = (grid_height - total_rows) // 2
         
-        # Apply vertical centering
-        centered_positions = [(x, y + vertical_offset) for x, y in positions]
+        # Generate every row at once: each row's elements are centered
+        # horizontally, and rows carry the vertical offset from the start
+        start_cols = (grid_width - elements_per_row) // 2
+        row_offsets = np.cumsum(elements_per_row) - elements_per_row
+        xs = (np.arange(int(elements_per_row.sum()))
+              + np.repeat(start_cols - row_offsets, elements_per_row))
+        ys = np.repeat(np.arange(total_rows) + vertical_offset, elements_per_row)
         
-        return centered_positions[:num_elements]
+        return np.stack([xs, ys], axis=1)[:num_elements].astype(np.int32)
         
     @staticmethod
     def generate_heart(num_elements, grid_width, grid_height):
@@ -227,15 +206,6 @@ class ShapeGenerator:
         If more than 12 blocks are requested, still return 12 positions
         and print a warning that the heart shape works best with 12 elements.
         """
-        # Define the fixed heart positions (12 blocks) exactly as in the JavaScript code
-        heart_template = [
-            (2, 3), (2, 6),                  # Top curves (2)
-            (3, 2), (3, 4), (3, 5), (3, 7),  # Upper middle row (4)
-            (4, 2), (4, 7),                  # Middle section (2)
-            (5, 3), (5, 6),                  # Bottom curves start (2)
-            (6, 4), (6, 5),                  # Bottom middle (2)
-        ]
-        
         # Check if more than 12 elements are requested
         if num_elements > 12:
             print(f"WARNING: Heart shape works best with exactly 12 elements. Currently using {num_elements} elements.")
@@ -249,24 +219,57 @@ class ShapeGenerator:
         row_offset = (grid_height - 10) // 2
         col_offset = (grid_width - 10) // 2
         
-        # Apply the offset to center the heart - convert from [row,col] to (x,y) format
-        centered_positions = [(col + col_offset, row + row_offset) for row, col in heart_template]
-        
-        # Take only as many positions as needed (up to 12)
-        result_positions = centered_positions[:actual_num]
+        # Take only as many positions as needed (up to 12), then apply the
+        # offset to center the heart and convert from [row,col] to (x,y) format
+        result_positions = (_HEART_TEMPLATE[:actual_num, ::-1] + (col_offset, row_offset)).astype(np.int32)
         
         # Debug output
-        print(f"HEART POSITIONS GENERATED (x,y format):")
-        for i, (x, y) in enumerate(result_positions):
-            print(f"  Position {i}: ({x},{y})")
+        if DEBUG:
+            print(f"HEART POSITIONS GENERATED (x,y format):")
+            for i, (x, y) in enumerate(result_positions):
+                print(f"  Position {i}: ({x},{y})")
         
         return result_positions
 
+    @staticmethod
+    def valid_position_mask(positions, grid):
+        """
+        Flag the positions that are inside the grid and not on a wall.
+        
+        Args:
+            positions: (N, 2) int array of (x, y) positions
+            grid: Grid to check against
+            
+        Returns:
+            Boolean array with one entry per position
+        """
+        xs, ys = positions[:, 0], positions[:, 1]
+        valid = (xs >= 0) & (xs < grid.width) & (ys >= 0) & (ys < grid.height)
+        valid[valid] = grid.grid[ys[valid], xs[valid]] != WALL
+        return valid
+
     @staticmethod
     def validate_positions(positions, grid):
         """Filter out positions that would be invalid in the grid."""
-        valid_positions = []
-        for x, y in positions:
-            if grid.is_valid_position(x, y) and not grid.is_wall(x, y):
-                valid_positions.append((x, y))
-        return valid_positions
\ No newline at end of file
+        positions = np.asarray(positions, dtype=np.int32).reshape(-1, 2)
+        return positions[ShapeGenerator.valid_position_mask(positions, grid)]
+
+
+# Shape generators by shape type, resolved once for generate_shape
+_GENERATORS = {
+    "square": ShapeGenerator.generate_square,
+    "circle": ShapeGenerator.generate_circle,
+    "triangle": ShapeGenerator.generate_triangle,
+    "heart": ShapeGenerator.generate_heart,
+}
+
+
+@lru_cache(maxsize=64)
+def _generate_shape_cached(shape_type, num_elements, grid_width, grid_height):
+    """Run the generator for shape_type once per argument tuple."""
+    generator = _GENERATORS.get(shape_type)
+    if generator is None:
+        raise ValueError(f"Unknown shape type: {shape_type}")
+    positions = generator(num_elements, grid_width, grid_height)
+    positions.flags.writeable = False
+    return positions
@@ -1,4 +1,7 @@
 # app/models/tetris_piece.py
+import numpy as np
+
+
 class TetrisPiece:
     """Represents a tetris piece in the programmable matter simulation."""
     
@@ -39,6 +42,21 @@ class TetrisPiece:
         ]
     }
     
+    # SHAPES as (rotations, 4, 2) int8 tables of (dx, dy) cell offsets
+    SHAPE_TABLES = {
+        shape_type: np.array(rotations, dtype=np.int8)
+        for shape_type, rotations in SHAPES.items()
+    }
+    
+    # Preview cells of every rotation, normalized to start at 0,0
+    PREVIEW_POSITIONS = {
+        shape_type: [
+            list(map(tuple, (cells - cells.min(axis=0)).tolist()))
+            for cells in table
+        ]
+        for shape_type, table in SHAPE_TABLES.items()
+    }
+    
     # Colors for each piece (matches the classic Tetris colors)
     COLORS = {
         'I': (0, 255, 255),   # Cyan
@@ -50,6 +68,17 @@ class TetrisPiece:
         'Z': (255, 0, 0)      # Red
     }
     
+    # Cell codes stored in the packed Tetris grid (0 is reserved for empty)
+    CODES = {
+        'I': 1,
+        'J': 2,
+        'L': 3,
+        'O': 4,
+        'S': 5,
+        'T': 6,
+        'Z': 7
+    }
+    
     def __init__(self, shape_type, grid_width, x=None, y=None):
         """
         Initialize a new Tetris piece.
@@ -68,10 +97,8 @@ class TetrisPiece:
         self.color = self.COLORS[shape_type]
         
         # Calculate piece width for centering
-        first_shape = self.SHAPES[shape_type][0]
-        min_x = min(x for x, y in first_shape)
-        max_x = max(x for x, y in first_shape)
-        piece_width = max_x - min_x + 1
+        first_xs = self.SHAPE_TABLES[shape_type][0, :, 0]
+        piece_width = int(first_xs.max() - first_xs.min()) + 1
         
         # Set position (center of grid if not specified)
         self.x = x if x is not None else ((grid_width - piece_width) // 2)
@@ -141,29 +168,17 @@ class TetrisPiece:
         Returns:
             List of positions where the shadow would be
         """
-        current_positions = self.get_positions()
-        shadow_y = self.y
+        # Drop the shadow straight to the boundary: the lowest cell of the
+        # piece lands on max_y - 1 (never above the piece itself)
+        # This would need to check for collisions in the actual grid
+        # For now, just use max_y as a boundary
+        table = self.SHAPE_TABLES[self.shape_type]
+        lowest_dy = int(table[self.rotation % len(table), :, 1].max())
+        drop = max(0, max_y - 1 - lowest_dy - self.y)
         
-        # Drop the shadow down until it would hit something
-        while shadow_y < max_y:
-            shadow_positions = [(x, shadow_y + 1 + (y - self.y)) for x, y in current_positions]
-            
-            # This would need to check for collisions in the actual grid
-            # For now, just use max_y as a boundary
-            if any(y >= max_y for _, y in shadow_positions):
-                break
-                
-            shadow_y += 1
-            
-        # Calculate the final shadow positions
-        return [(x, shadow_y + (y - self.y)) for x, y in current_positions]
+        return [(x, y + drop) for x, y in self.get_positions()]
     
     def get_preview_positions(self):
         """Get the positions for piece preview (shown at the top of the game)."""
-        shape = self.get_current_shape()
-        
-        # Normalize to start at 0,0
-        min_x = min(x for x, y in shape)
-        min_y = min(y for x, y in shape)
-        
-        return [(x - min_x, y - min_y) for x, y in shape]
\ No newline at end of file
+        previews = self.PREVIEW_POSITIONS[self.shape_type]
+        return list(previews[self.rotation % len(previews)])
\ No newline at end of file
@@ -1,7 +1,218 @@
+import math
+from functools import lru_cache
+
 import gymnasium as gym
 from gymnasium import spaces
 import numpy as np
 
+from app.models.grid import WALL, ELEMENT
+
+try:
+    import _pm_env_kernel
+except ImportError:  # Compiled kernels are optional; see _pm_env_kernel.pyx
+    _pm_env_kernel = None
+
+if _pm_env_kernel is None:
+    try:
+        from numba import njit
+    except ImportError:  # Numba is optional; fall back to plain Python below
+        njit = None
+else:
+    njit = None  # Already compiled ahead of time; skip the Numba import and JIT
+
+
+def _is_blocked_py(cells, obstacle_grid, x, y):
+    """Check if (x, y) is off-grid, a wall, an element or another agent."""
+    height, width = cells.shape
+    if x < 0 or y < 0 or x >= width or y >= height:
+        return True
+    cell = cells[y, x]
+    return cell == WALL or cell == ELEMENT or obstacle_grid[y, x] != 0
+
+
+def _fill_obs_py(obs, ax, ay, tx, ty, cells, obstacle_grid):
+    """
+    Write [ax,ay,tx,ty] plus binary flags for each of 8 neighbors into obs.
+    
+    Args:
+        obs: float32 array of length 12 to fill
+        ax, ay: Agent position
+        tx, ty: Target position
+        cells: Grid cell types as a 2D int8 array
+        obstacle_grid: 2D uint8 array, nonzero where another agent sits
+    """
+    obs[0] = ax
+    obs[1] = ay
+    obs[2] = tx
+    obs[3] = ty
+    
+    # All 8 Moore neighbors, unrolled in (dx, dy) order
+    obs[4] = _is_blocked(cells, obstacle_grid, ax - 1, ay - 1)
+    obs[5] = _is_blocked(cells, obstacle_grid, ax - 1, ay)
+    obs[6] = _is_blocked(cells, obstacle_grid, ax - 1, ay + 1)
+    obs[7] = _is_blocked(cells, obstacle_grid, ax, ay - 1)
+    obs[8] = _is_blocked(cells, obstacle_grid, ax, ay + 1)
+    obs[9] = _is_blocked(cells, obstacle_grid, ax + 1, ay - 1)
+    obs[10] = _is_blocked(cells, obstacle_grid, ax + 1, ay)
+    obs[11] = _is_blocked(cells, obstacle_grid, ax + 1, ay + 1)
+
+
+def _fill_obs_shifted_py(obs, prev_obs, dx, dy, ax, ay, tx, ty, cells, obstacle_grid):
+    """
+    Fill obs after a move of (dx, dy), reusing the neighbor flags in
+    prev_obs that still fall inside the new 3x3 window.
+    
+    Only valid when the grid and obstacles are unchanged since prev_obs
+    was filled and the move is a single Moore step.
+    """
+    obs[0] = ax
+    obs[1] = ay
+    obs[2] = tx
+    obs[3] = ty
+    
+    i = 4
+    for ox in range(-1, 2):
+        for oy in range(-1, 2):
+            if ox == 0 and oy == 0:
+                continue
+            # Same cell seen from the previous position
+            px, py = ox + dx, oy + dy
+            if -1 <= px <= 1 and -1 <= py <= 1 and (px != 0 or py != 0):
+                k = (px + 1) * 3 + (py + 1)
+                obs[i] = prev_obs[4 + k - (k > 4)]
+            else:
+                obs[i] = _is_blocked(cells, obstacle_grid, ax + ox, ay + oy)
+            i += 1
+
+
+def _step_obs_py(obs, prev_obs, reuse, ax, ay, tx, ty, dist2, dx, dy,
+                 cells, obstacle_grid, collision_penalty, success_reward):
+    """
+    Apply one move, compute its reward and write the resulting observation.
+    
+    Args:
+        obs: float32 array of length 12 to fill
+        prev_obs: Observation at (ax, ay)
+        reuse: True if prev_obs was built on the current grid and obstacles,
+            so its neighbor flags can stand in for fresh probes
+        ax, ay: Agent position before the move
+        tx, ty: Target position
+        dist2: Squared distance from (ax, ay) to the target
+        dx, dy: Move offset
+        cells: Grid cell types as a 2D int8 array
+        obstacle_grid: 2D uint8 array, nonzero where another agent sits
+        collision_penalty: Reward for a blocked move
+        success_reward: Bonus for reaching the target
+        
+    Returns:
+        Tuple of (new_ax, new_ay, new_dist2, reward)
+    """
+    height, width = cells.shape
+    
+    # Compute new position and clip to grid bounds
+    nx = min(max(ax + dx, 0), width - 1)
+    ny = min(max(ay + dy, 0), height - 1)
+    mx, my = nx - ax, ny - ay
+    
+    # Collision check (static grid or dynamic obstacles); a real move
+    # targets one of the 8 neighbors already flagged in prev_obs
+    if reuse and (mx != 0 or my != 0):
+        k = (mx + 1) * 3 + (my + 1)
+        blocked = prev_obs[4 + k - (k > 4)] != 0
+    else:
+        blocked = _is_blocked(cells, obstacle_grid, nx, ny)
+    
+    if blocked:
+        # illegal: revert and heavy penalty
+        nx, ny, mx, my = ax, ay, 0, 0
+        new_dist2 = dist2
+        reward = collision_penalty
+    else:
+        # Update the squared distance for the (mx, my) actually moved:
+        # (d + m)^2 = d^2 + (2d + m) * m per axis
+        new_dist2 = dist2 + (2 * (ax - tx) + mx) * mx + (2 * (ay - ty) + my) * my
+        
+        # shaped reward: closer → positive, big bonus on success
+        reward = (math.sqrt(dist2) - math.sqrt(new_dist2)) * 2.0
+        if new_dist2 == 0:
+            reward += success_reward
+    
+    # Observation at the resulting position, in the same pass
+    if reuse:
+        _fill_obs_shifted(obs, prev_obs, mx, my, nx, ny, tx, ty, cells, obstacle_grid)
+    else:
+        _fill_obs(obs, nx, ny, tx, ty, cells, obstacle_grid)
+    return nx, ny, new_dist2, reward
+
+
+if _pm_env_kernel is not None:
+    _is_blocked = _is_blocked_py
+    _fill_obs = _pm_env_kernel.fill_obs
+    _fill_obs_shifted = _pm_env_kernel.fill_obs_shifted
+    _step_obs = _pm_env_kernel.step_obs
+elif njit is not None:
+    _is_blocked = njit(cache=True)(_is_blocked_py)
+    _fill_obs = njit(cache=True)(_fill_obs_py)
+    _fill_obs_shifted = njit(cache=True)(_fill_obs_shifted_py)
+    _step_obs = njit(cache=True)(_step_obs_py)
+else:
+    _is_blocked = _is_blocked_py
+    _fill_obs = _fill_obs_py
+    _fill_obs_shifted = _fill_obs_shifted_py
+    _step_obs = _step_obs_py
+
+
+# Set once the JIT kernels have been compiled (or loaded from cache) in
+# this process
+_kernels_warm = njit is None
+
+
+def _warm_up_kernels(cells, obstacle_grid):
+    """
+    Compile the Numba kernels for the argument types the env uses, so the
+    compile (or cache load) happens at construction, not on the first step.
+    """
+    global _kernels_warm
+    obs = np.zeros(12, dtype=np.float32)
+    _fill_obs(obs, 0, 0, 0, 0, cells, obstacle_grid)
+    for reuse in (False, True):
+        _step_obs(obs, obs, reuse, 0, 0, 0, 0, 0, 0, 0,
+                  cells, obstacle_grid, 0.0, 0.0)
+    _kernels_warm = True
+
+
+# Moore moves indexed by action: stay + 8 directions. The order is part of
+# the trained policies' action space, so it must not change
+MOORE_DELTAS = np.array([
+    ( 0,  0), ( 0, -1), ( 0,  1),
+    (-1,  0), ( 1,  0),
+    (-1, -1), ( 1, -1),
+    (-1,  1), ( 1,  1)
+], dtype=np.int8)
+
+# The same moves as plain int pairs, for decoding one action at a time
+# without creating NumPy scalars
+_MOVE_TUPLES = tuple(map(tuple, MOORE_DELTAS.tolist()))
+
+# Discrete 9-action Moore moves, shared by every env
+_ACTION_SPACE = spaces.Discrete(9)
+
+
+@lru_cache(maxsize=None)
+def _observation_space(width, height, dtype=np.float32):
+    """
+    Observation space for a width x height grid: (ax,ay,tx,ty) + 8 neighbor
+    flags. Cached, so envs on the same grid size share one Box.
+    """
+    low  = np.array([0,0,0,0] + [0]*8, dtype=dtype)
+    high = np.array(
+        [width-1, height-1,
+         width-1, height-1] + [1]*8,
+        dtype=dtype
+    )
+    return spaces.Box(low=low, high=high, dtype=dtype)
+
+
 class ProgrammableMatterEnvMoore(gym.Env):
     """
     RL environment on a 2D grid using Moore (8-neighborhood) moves,
@@ -25,33 +236,92 @@ class ProgrammableMatterEnvMoore(gym.Env):
         self.collision_penalty = collision_penalty
         self.success_reward    = success_reward
 
-        # Dynamic set of other-agent obstacles
+        # Dynamic other-agent obstacles as a dense grid mask
         # Should be updated externally via update_obstacles(...)
-        self.obstacles = set(obstacles) if obstacles is not None else set()
+        self._obstacle_buf = np.zeros((grid.height, grid.width), dtype=np.uint8)
+        self._obstacle_grid = self._obstacle_buf
+        self._obstacle_xs = self._obstacle_ys = np.empty(0, dtype=np.int32)
+        self._obstacle_version = 0
 
-        # Agent and goal positions
-        self.agent_pos  = np.array(start_pos,  dtype=np.int32)
-        self.target_pos = np.array(target_pos, dtype=np.int32)
-        self.step_count = 0
+        # Observations are written into two preallocated buffers in turn, so
+        # the previous one stays intact while the next is filled
+        self._obs_bufs = (np.empty(12, dtype=np.float32), np.empty(12, dtype=np.float32))
+        self._obs_index = 0
+
+        # Positions, obstacles and observation cache
+        self.reconfigure(start_pos, target_pos, obstacles)
+
+        if not _kernels_warm:
+            _warm_up_kernels(grid.grid, self._obstacle_buf)
 
         # Discrete 9-action Moore moves
-        self.action_space = spaces.Discrete(9)
+        self.action_space = _ACTION_SPACE
 
         # Observation: (ax,ay,tx,ty) + 8 neighbor flags
-        low  = np.array([0,0,0,0] + [0]*8, dtype=np.float32)
-        high = np.array(
-            [grid.width-1, grid.height-1,
-             grid.width-1, grid.height-1] + [1]*8,
-            dtype=np.float32
-        )
-        self.observation_space = spaces.Box(low=low, high=high, dtype=np.float32)
+        self.observation_space = _observation_space(grid.width, grid.height)
+
+    @property
+    def agent_pos(self):
+        """Current agent position as an (x, y) tuple."""
+        return (self.ax, self.ay)
+
+    @property
+    def target_pos(self):
+        """Goal position as an (x, y) tuple."""
+        return (self.tx, self.ty)
+
+    def reconfigure(self, start_pos, target_pos, obstacles=None):
+        """
+        Point the env at a new start and goal on the same grid, so one
+        instance can be reused instead of constructing a new env.
+        Call reset() afterwards as usual.
+        """
+        # Drop the previous episode's obstacles
+        self._clear_obstacles()
+        self._obstacle_version += 1
+        if obstacles is not None:
+            self.update_obstacles(obstacles)
+
+        # Last observation and the (x, y, grid version, obstacle version) it
+        # was built for, so the next one can reuse overlapping neighbor flags
+        self._last_obs = None
+        self._last_obs_key = None
+
+        # Agent and goal positions as plain ints
+        self.ax, self.ay = int(start_pos[0]), int(start_pos[1])
+        self.tx, self.ty = int(target_pos[0]), int(target_pos[1])
+        self._dist2 = (self.ax - self.tx) ** 2 + (self.ay - self.ty) ** 2
+        self.step_count = 0
+
+    def _clear_obstacles(self):
+        """Unmark the cells set last time and switch back to the own mask."""
+        self._obstacle_buf[self._obstacle_ys, self._obstacle_xs] = 0
+        self._obstacle_xs = self._obstacle_ys = np.empty(0, dtype=np.int32)
+        self._obstacle_grid = self._obstacle_buf
 
     def update_obstacles(self, obstacles):
         """
         Call this at each time step to let the env know
         where the other agents currently sit.
+
+        obstacles is either an iterable of (x, y) cells or a caller-owned
+        (height, width) uint8 mask, nonzero where another agent sits. A mask
+        is read in place rather than copied; call update_obstacles again
+        after changing it so stale observations are not reused.
         """
-        self.obstacles = set(obstacles)
+        # Clear only the cells set last time
+        self._clear_obstacles()
+
+        if isinstance(obstacles, np.ndarray):
+            self._obstacle_grid = obstacles
+        else:
+            # Mark the new cells with one fancy-indexed write
+            xy = np.array(list(obstacles), dtype=np.int32).reshape(-1, 2)
+            xs, ys = xy[:, 0], xy[:, 1]
+            inside = (xs >= 0) & (xs < self.grid.width) & (ys >= 0) & (ys < self.grid.height)
+            self._obstacle_xs, self._obstacle_ys = xs[inside], ys[inside]
+            self._obstacle_buf[self._obstacle_ys, self._obstacle_xs] = 1
+        self._obstacle_version += 1
 
     def reset(self, *, seed=None, options=None):
         """Resets step counter; positions stay as constructed."""
@@ -59,71 +329,46 @@ class ProgrammableMatterEnvMoore(gym.Env):
         return self._get_obs(), {}
 
     def _get_obs(self):
-        """Return [ax,ay,tx,ty] plus binary flags for each of 8 neighbors."""
-        ax, ay = self.agent_pos
-        tx, ty = self.target_pos
-
-        # Check all 8 Moore neighbors
-        offsets = [(-1, -1), (-1, 0), (-1, 1),
-                   ( 0, -1),          ( 0, 1),
-                   ( 1, -1), ( 1, 0), ( 1, 1)]
-        flags = []
-        for dx, dy in offsets:
-            nx, ny = ax + dx, ay + dy
-            blocked = (
-                nx < 0 or ny < 0 or
-                nx >= self.grid.width or
-                ny >= self.grid.height or
-                self.grid.is_occupied(nx, ny) or
-                (nx, ny) in self.obstacles
-            )
-            flags.append(1.0 if blocked else 0.0)
-
-        return np.array([ax, ay, tx, ty] + flags, dtype=np.float32)
+        """
+        Return [ax,ay,tx,ty] plus binary flags for each of 8 neighbors.
+
+        The returned array is a reused buffer that is overwritten two calls
+        later; copy it to keep it longer.
+        """
+        obs = self._obs_bufs[self._obs_index]
+        self._obs_index ^= 1
+        _fill_obs(obs, self.ax, self.ay, self.tx, self.ty,
+                  self.grid.grid, self._obstacle_grid)
+
+        self._last_obs = obs
+        self._last_obs_key = (self.ax, self.ay, self.grid.version, self._obstacle_version)
+        return obs
 
     def step(self, action):
         """Apply `action`, avoid collisions, and return (obs, reward, done, _, _)."""
         self.step_count += 1
-        old_pos = self.agent_pos.copy()
-
-        # Define Moore moves: stay + 8 directions
-        moves = [
-            ( 0,  0), ( 0, -1), ( 0,  1),
-            (-1,  0), ( 1,  0),
-            (-1, -1), ( 1, -1),
-            (-1,  1), ( 1,  1)
-        ]
-        dx, dy = moves[action]
-
-        # Compute new position and clip to grid bounds
-        raw_new = old_pos + np.array([dx, dy], dtype=int)
-        new_pos = np.clip(
-            raw_new,
-            [0, 0],
-            [self.grid.width - 1, self.grid.height - 1]
-        )
 
-        new_tup = (int(new_pos[0]), int(new_pos[1]))
+        dx, dy = _MOVE_TUPLES[action]
 
-        # Collision check (static grid or dynamic obstacles)
-        if self.grid.is_occupied(*new_pos) or new_tup in self.obstacles:
-            # illegal: revert and heavy penalty
-            self.agent_pos = old_pos
-            reward = self.collision_penalty
-        else:
-            # valid move
-            self.agent_pos = new_pos
-            # shaped reward: closer → positive, big bonus on success
-            dist_old = np.linalg.norm(old_pos - self.target_pos)
-            dist_new = np.linalg.norm(new_pos - self.target_pos)
-            reward   = (dist_old - dist_new) * 2.0
-            if np.array_equal(new_pos, self.target_pos):
-                reward += self.success_reward
+        # The last observation's flags are still valid if it was built here
+        # and nothing on the board has changed since
+        reuse = self._last_obs_key == (self.ax, self.ay, self.grid.version, self._obstacle_version)
+        obs = self._obs_bufs[self._obs_index]
+        self._obs_index ^= 1
+
+        self.ax, self.ay, self._dist2, reward = _step_obs(
+            obs, self._last_obs if reuse else obs, reuse,
+            self.ax, self.ay, self.tx, self.ty, self._dist2,
+            dx, dy, self.grid.grid, self._obstacle_grid,
+            float(self.collision_penalty), float(self.success_reward)
+        )
+
+        self._last_obs = obs
+        self._last_obs_key = (self.ax, self.ay, self.grid.version, self._obstacle_version)
 
         done = (
-            np.array_equal(self.agent_pos, self.target_pos) or
+            (self.ax == self.tx and self.ay == self.ty) or
             self.step_count >= self.max_steps
         )
 
-        return self._get_obs(), float(reward), bool(done), False, {}
-
+        return obs, float(reward), bool(done), False, {}
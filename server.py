@@ -3,17 +3,67 @@ from flask import Flask, request, jsonify, render_template, send_from_directory
 import os
 import subprocess
 import sys
-import os
-from app.controllers.simulation import ProgrammableMatterSimulation
+from app.controllers.simulation import ProgrammableMatterSimulation, DEBUG
 import random
 import time
+import threading
 import numpy as np
-from stable_baselines3 import PPO
-from pm_env_moore import ProgrammableMatterEnvMoore
 
 app = Flask(__name__, static_folder='static')
+
 simulation = ProgrammableMatterSimulation(width=12, height=12)
 
+# PPO policy and RL envs shared across /api/transform_rl requests
+_PPO_MODEL = None
+_ENV_POOL = []
+_RL_LOCK = threading.Lock()
+
+# RL dependencies pull in PyTorch, Gymnasium and Numba, so they are imported
+# by load_rl() on the first RL request rather than at server start
+PPO = None
+ProgrammableMatterEnvMoore = None
+_is_surrounded = None
+
+def load_rl():
+    """Import the RL dependencies and compile the RL kernels once."""
+    global PPO, ProgrammableMatterEnvMoore, _is_surrounded
+    if PPO is None:
+        with _RL_LOCK:
+            if PPO is None:
+                from stable_baselines3 import PPO as ppo_cls
+                from pm_env_moore import ProgrammableMatterEnvMoore as env_cls
+                try:
+                    from numba import njit
+                except ImportError:  # Numba is optional; fall back to plain Python
+                    njit = None
+
+                _is_surrounded = njit(cache=True)(_is_surrounded_py) if njit is not None else _is_surrounded_py
+                ProgrammableMatterEnvMoore = env_cls
+                PPO = ppo_cls
+
+def get_ppo_model():
+    """Load the Moore PPO policy on first use and reuse it afterwards."""
+    global _PPO_MODEL
+    if _PPO_MODEL is None:
+        with _RL_LOCK:
+            if _PPO_MODEL is None:
+                _PPO_MODEL = PPO.load(os.path.join(os.getcwd(), "models", "ppo_moore_final"))
+    return _PPO_MODEL
+
+def acquire_env(grid, start, target):
+    """Take an env from the pool (or build one) set up for start -> target."""
+    with _RL_LOCK:
+        env = _ENV_POOL.pop() if _ENV_POOL else None
+    if env is None or env.grid is not grid:
+        return ProgrammableMatterEnvMoore(grid, start, target)
+    env.reconfigure(start, target)
+    return env
+
+def release_envs(envs):
+    """Return envs to the pool for the next request."""
+    with _RL_LOCK:
+        _ENV_POOL.extend(envs)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -22,14 +72,22 @@ def index():
 def serve_static(path):
     return send_from_directory('static', path)
 
-def get_neighbors(pos, grid_size):
-    """Return in‐bounds Moore neighbors of `pos` on a grid of size grid_size."""
-    x, y = pos
-    deltas = [(-1, -1), (-1, 0), (-1, 1),
-              ( 0, -1),          ( 0, 1),
-              ( 1, -1), ( 1, 0), ( 1, 1)]
-    neighs = [(x + dx, y + dy) for dx, dy in deltas]
-    return [(nx, ny) for nx, ny in neighs if 0 <= nx < grid_size and 0 <= ny < grid_size]
+def _is_surrounded_py(occupied_mask, x, y, grid_size):
+    """
+    Check whether every in-bounds Moore neighbor of (x, y) is occupied in
+    the flat (x * grid_size + y) occupancy mask.
+    """
+    for dx in range(-1, 2):
+        nx = x + dx
+        if nx < 0 or nx >= grid_size:
+            continue
+        for dy in range(-1, 2):
+            ny = y + dy
+            if (dx == 0 and dy == 0) or ny < 0 or ny >= grid_size:
+                continue
+            if occupied_mask[nx * grid_size + ny] == 0:
+                return False
+    return True
 
 
 
@@ -67,16 +125,18 @@ def transform():
         # Initialize the simulation with the specified number of elements
         elements = simulation.initialize_elements(num_elements)
         
-        print("INITIAL ELEMENT POSITIONS:")
-        for eid, element in simulation.controller.elements.items():
-            print(f"  Element {eid}: ({element.x}, {element.y})")
+        if DEBUG:
+            print("INITIAL ELEMENT POSITIONS:")
+            for eid, element in simulation.controller.elements.items():
+                print(f"  Element {eid}: ({element.x}, {element.y})")
         
         # Set the target shape
         targets = simulation.set_target_shape(shape, num_elements)
         
-        print("TARGET POSITIONS:")
-        for i, (tx, ty) in enumerate(targets):
-            print(f"  Target {i}: ({tx}, {ty})")
+        if DEBUG:
+            print("TARGET POSITIONS:")
+            for i, (tx, ty) in enumerate(targets):
+                print(f"  Target {i}: ({tx}, {ty})")
         
         # Run the transformation - now supports minimax, expectimax, and adaptive
         result = simulation.transform(
@@ -94,9 +154,10 @@ def transform():
             print(f"  Nodes explored: {result.get('nodes_explored', 0)}")
             
             # Detailed move logging
-            print("MOVES (Backend format):")
-            for i, move in enumerate(result['moves']):
-                print(f"  Move {i}: Agent {move['agentId']} from {move['from']} to {move['to']}")
+            if DEBUG:
+                print("MOVES (Backend format):")
+                for i, move in enumerate(result['moves']):
+                    print(f"  Move {i}: Agent {move['agentId']} from {move['from']} to {move['to']}")
         
         # Format the moves for the frontend with explicit coordinate handling
         frontend_moves = []
@@ -110,20 +171,21 @@ def transform():
             }
             frontend_moves.append(frontend_move)
         
-        # Log frontend moves
-        print("MOVES (Frontend format):")
-        for i, move in enumerate(frontend_moves):
-            print(f"  Move {i}: Agent {move['agentId']} from ({move['from']['x']},{move['from']['y']}) to ({move['to']['x']},{move['to']['y']})")
-        
-        # Final element positions
-        print("FINAL ELEMENT POSITIONS:")
-        for eid, element in simulation.controller.elements.items():
-            if hasattr(element, 'target_x') and element.target_x is not None:
-                at_target = element.x == element.target_x and element.y == element.target_y
-                status = "AT TARGET" if at_target else "NOT AT TARGET"
-                print(f"  Element {eid}: ({element.x}, {element.y}) -> Target: ({element.target_x}, {element.target_y}) {status}")
-            else:
-                print(f"  Element {eid}: ({element.x}, {element.y}) -> No target assigned")
+        if DEBUG:
+            # Log frontend moves
+            print("MOVES (Frontend format):")
+            for i, move in enumerate(frontend_moves):
+                print(f"  Move {i}: Agent {move['agentId']} from ({move['from']['x']},{move['from']['y']}) to ({move['to']['x']},{move['to']['y']})")
+            
+            # Final element positions
+            print("FINAL ELEMENT POSITIONS:")
+            for eid, element in simulation.controller.elements.items():
+                if hasattr(element, 'target_x') and element.target_x is not None:
+                    at_target = element.x == element.target_x and element.y == element.target_y
+                    status = "AT TARGET" if at_target else "NOT AT TARGET"
+                    print(f"  Element {eid}: ({element.x}, {element.y}) -> Target: ({element.target_x}, {element.target_y}) {status}")
+                else:
+                    print(f"  Element {eid}: ({element.x}, {element.y}) -> No target assigned")
         
         # Prepare the response
         response = {
@@ -170,6 +232,40 @@ def get_available_algorithms():
     }
     return jsonify({'algorithms': algorithms})
 
+def run_algorithm(alg, start_state, width, height, topology, control_mode):
+    """
+    Run one algorithm on a private simulation restored from start_state.
+    
+    Returns:
+        Dictionary with success_rate, moves, time and nodes_explored
+    """
+    sim = ProgrammableMatterSimulation(width=width, height=height)
+    sim.restore(start_state)
+    
+    # Run transformation
+    result = sim.transform(
+        algorithm=alg,
+        topology=topology,
+        movement='parallel',  # Use parallel for better comparison
+        control_mode=control_mode
+    )
+    
+    # Calculate success rate
+    success_rate = 0
+    total_elements = sum(1 for e in sim.controller.elements.values() if e.has_target())
+    at_target = sum(1 for e in sim.controller.elements.values() 
+                 if e.has_target() and e.x == e.target_x and e.y == e.target_y)
+    
+    if total_elements > 0:
+        success_rate = at_target / total_elements
+    
+    return {
+        'success_rate': success_rate,
+        'moves': len(result.get('moves', [])),
+        'time': result.get('time', 0),
+        'nodes_explored': result.get('nodes_explored', 0)
+    }
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze_performance():
     """
@@ -191,43 +287,22 @@ def analyze_performance():
         
         results = {}
         
-        # Run each algorithm
+        # Set up the start state once; every algorithm starts from a copy
+        simulation.reset()
+        simulation.initialize_elements(num_elements)
+        simulation.set_target_shape(shape, num_elements)
+        start_state = simulation.snapshot()
+        
+        # Each run takes a few ms on the server's 12x12 grid, less than
+        # handing it to a worker process would cost, so run them in turn
+        width, height = simulation.grid.width, simulation.grid.height
         for alg in algorithms:
-            print(f"Testing algorithm: {alg}")
+            results[alg] = run_algorithm(alg, start_state, width, height, topology, control_mode)
             
-            # Reset simulation for clean comparison
-            simulation.reset()
-            simulation.initialize_elements(num_elements)
-            simulation.set_target_shape(shape, num_elements)
-            
-            # Run transformation
-            result = simulation.transform(
-                algorithm=alg,
-                topology=topology,
-                movement='parallel',  # Use parallel for better comparison
-                control_mode=control_mode
-            )
-            
-            # Store results
-            success_rate = 0
-            # Calculate success rate
-            total_elements = sum(1 for e in simulation.controller.elements.values() if e.has_target())
-            at_target = sum(1 for e in simulation.controller.elements.values() 
-                         if e.has_target() and e.x == e.target_x and e.y == e.target_y)
-            
-            if total_elements > 0:
-                success_rate = at_target / total_elements
-            
-            results[alg] = {
-                'success_rate': success_rate,
-                'moves': len(result.get('moves', [])),
-                'time': result.get('time', 0),
-                'nodes_explored': result.get('nodes_explored', 0)
-            }
-            
-            print(f"  Success rate: {success_rate*100:.1f}%")
-            print(f"  Moves: {len(result.get('moves', []))}")
-            print(f"  Time: {result.get('time', 0):.2f}s")
+            print(f"Tested algorithm: {alg}")
+            print(f"  Success rate: {results[alg]['success_rate']*100:.1f}%")
+            print(f"  Moves: {results[alg]['moves']}")
+            print(f"  Time: {results[alg]['time']:.2f}s")
             
         return jsonify({
             'success': True,
@@ -267,7 +342,7 @@ def analyze_deadlock_locations():
         num_runs = data.get('runs', 5)
         
         # Create a grid to track deadlock locations
-        deadlock_grid = [[0 for _ in range(simulation.grid.width)] for _ in range(simulation.grid.height)]
+        deadlock_grid = np.zeros((simulation.grid.height, simulation.grid.width), dtype=np.int32)
         
         # Run multiple transformations and track where elements get stuck
         for run in range(num_runs):
@@ -287,22 +362,23 @@ def analyze_deadlock_locations():
             )
             
             # Check which elements didn't reach targets
-            for eid, element in simulation.controller.elements.items():
-                if element.has_target() and (element.x != element.target_x or element.y != element.target_y):
-                    # Increment deadlock counter for this position
-                    deadlock_grid[element.y][element.x] += 1
-        
-        # Prepare result with normalized heatmap
-        max_value = max(max(row) for row in deadlock_grid)
-        normalized_grid = []
-        if max_value > 0:
-            normalized_grid = [[cell/max_value for cell in row] for row in deadlock_grid]
-        else:
-            normalized_grid = deadlock_grid
+            stuck = [element for element in simulation.controller.elements.values()
+                     if element.has_target() and (element.x != element.target_x or element.y != element.target_y)]
+            
+            # Increment deadlock counters for all their positions at once
+            ys = np.fromiter((element.y for element in stuck), dtype=np.int32, count=len(stuck))
+            xs = np.fromiter((element.x for element in stuck), dtype=np.int32, count=len(stuck))
+            np.add.at(deadlock_grid, (ys, xs), 1)
+        
+        # Prepare result with normalized heatmap; one reduction for the max
+        # and one conversion per grid (shared when there is nothing to scale)
+        max_value = int(deadlock_grid.max())
+        counts = deadlock_grid.tolist()
+        normalized_grid = (deadlock_grid / max_value).tolist() if max_value > 0 else counts
         
         return jsonify({
             'success': True,
-            'deadlock_grid': deadlock_grid,
+            'deadlock_grid': counts,
             'normalized_grid': normalized_grid,
             'max_value': max_value,
             'runs': num_runs
@@ -532,6 +608,7 @@ def launch_tetris_ai():
 
 @app.route('/api/transform_rl', methods=['POST'])
 def transform_rl():
+    agents = {}
     try:
         data = request.json
         shape        = data.get('shape',        'square')
@@ -543,97 +620,141 @@ def transform_rl():
         simulation.set_target_shape(shape, num_elements)
         simulation.controller.assign_targets()
 
-        # 2) Load PPO model & grid size
+        # 2) Cached PPO model & grid size
+        load_rl()
         grid_size = simulation.grid.width
-        model     = PPO.load(os.path.join(os.getcwd(), "models", "ppo_moore_final"))
+        model     = get_ppo_model()
 
-        # 3) Build one env + obs per agent
-        agents = {}
+        # 3) Set up one pooled env + obs per agent
         for eid, elem in simulation.controller.elements.items():
             if not elem.has_target():
                 continue
             start = (elem.x, elem.y)
             tgt   = (elem.target_x, elem.target_y)
-            env   = ProgrammableMatterEnvMoore(simulation.grid, start, tgt)
+            env   = acquire_env(simulation.grid, start, tgt)
             obs, _= env.reset()
-            agents[eid] = {"env": env, "obs": obs, "done": False}
+            agents[eid] = {"env": env, "obs": obs, "done": False, "stuck": 0, "fallback": False,
+                           "seen_version": -1}
 
         frontend_moves = []
         start_time     = time.time()
         max_steps      = 200
+        stuck_limit    = 2   # consecutive collisions before handing off to A*
 
-        # 4) Pre-build list of agent IDs
-        agent_ids = list(agents.keys())
+        # Occupancy as a flat x * grid_size + y mask for the fully-blocked check
+        occupied_mask = np.zeros(grid_size * grid_size, dtype=np.uint8)
+
+        # The same cells as a [y, x] mask that every env reads in place as
+        # its obstacles. An agent's own cell is an ELEMENT on the simulation
+        # grid anyway, so it need not be left out per agent
+        obstacle_grid = np.zeros((simulation.grid.height, simulation.grid.width), dtype=np.uint8)
+
+        # 4) Live agents and the cells they occupy, kept up to date as
+        #    agents move or finish rather than rebuilt every tick
+        live_ids = list(agents.keys())
+        for eid in live_ids:
+            ox, oy = agents[eid]["env"].agent_pos
+            occupied_mask[ox * grid_size + oy] = 1
+            obstacle_grid[oy, ox] = 1
+
+        # Bumped whenever occupancy changes, so agents only refresh their
+        # env obstacles when something moved since their last turn
+        occupancy_version = 0
 
         # 5) Interleaved, randomized RL stepping
         for _ in range(max_steps):
             any_moved = False
-
-            # Compute occupied cells
-            occupied = {
-                tuple(a["env"].agent_pos)
-                for a in agents.values() if not a["done"]
-            }
+            finished  = []
 
             # Shuffle turn order each tick
-            random.shuffle(agent_ids)
+            random.shuffle(live_ids)
+            if not live_ids:
+                break
 
-            for eid in agent_ids:
-                a = agents[eid]
-                if a["done"]:
-                    continue
+            # PPO actions for every live agent in one batched forward pass;
+            # each agent acts on the observation from its previous step
+            actions, _ = model.predict(np.stack([agents[eid]["obs"] for eid in live_ids]))
 
-                env, obs = a["env"], a["obs"]
+            for eid, action in zip(live_ids, actions):
+                a   = agents[eid]
+                env = a["env"]
                 pos = tuple(env.agent_pos)
 
                 # Tell env about other agents
-                env.update_obstacles(occupied - {pos})
+                if a["seen_version"] != occupancy_version:
+                    env.update_obstacles(obstacle_grid)
+                    a["seen_version"] = occupancy_version
 
                 # If fully blocked, skip
-                neighs = get_neighbors(pos, grid_size)
-                if all(n in occupied for n in neighs):
+                if _is_surrounded(occupied_mask, pos[0], pos[1], grid_size):
                     continue
 
                 # PPO step
-                action, _        = model.predict(obs)
-                obs2, _, done, _, _ = env.step(action)
+                obs2, reward, done, _, _ = env.step(action)
                 new = tuple(env.agent_pos)
 
                 if new != pos:
-                    # record move
+                    # record move as plain ints so it is JSON-ready
                     frontend_moves.append({
-                        "agentId": eid,
-                        "from":   {"x": pos[0] - 1, "y": pos[1] - 1},
-                        "to":     {"x": new[0] - 1, "y": new[1] - 1}
+                        "agentId": int(eid),
+                        "from":   {"x": int(pos[0]) - 1, "y": int(pos[1]) - 1},
+                        "to":     {"x": int(new[0]) - 1, "y": int(new[1]) - 1}
                     })
                     any_moved = True
 
                     # update main simulation grid
                     simulation.controller.move_element(eid, new[0], new[1])
 
-                    occupied.remove(pos)
-                    occupied.add(new)
+                    occupied_mask[pos[0] * grid_size + pos[1]] = 0
+                    occupied_mask[new[0] * grid_size + new[1]] = 1
+                    obstacle_grid[pos[1], pos[0]] = 0
+                    obstacle_grid[new[1], new[0]] = 1
+                    occupancy_version += 1
+
+                # The policy samples its actions, so one blocked move may be
+                # followed by a free one; an agent whose moves keep being
+                # blocked is handed to A* early instead
+                if reward == env.collision_penalty:
+                    a["stuck"] += 1
+                else:
+                    a["stuck"] = 0
 
                 a["obs"]  = obs2
                 if done:
                     a["done"] = True
+                    finished.append(eid)
+                elif a["stuck"] >= stuck_limit:
+                    a["done"] = True
+                    a["fallback"] = True
+                    finished.append(eid)
+
+            # Finished agents stop counting as occupied from the next tick
+            if finished:
+                for eid in finished:
+                    fx, fy = agents[eid]["env"].agent_pos
+                    occupied_mask[fx * grid_size + fy] = 0
+                    obstacle_grid[fy, fx] = 0
+                occupancy_version += 1
+                live_ids = [eid for eid in live_ids if not agents[eid]["done"]]
 
             if not any_moved:
                 break
 
-        # 6) A* fallback for any agents still not at target
+        # 6) A* fallback for any agents still not at target, all searched
+        #    against one list copy of the board kept in sync as they move
+        cells = simulation.grid.grid.tolist()
         for eid, a in agents.items():
-            if a["done"]:
+            if a["done"] and not a["fallback"]:
                 continue
 
             elem = simulation.controller.elements[eid]
             sx, sy = elem.x, elem.y
             tx, ty = elem.target_x, elem.target_y
 
-            path, _ = simulation.find_path(
+            path, _ = simulation.find_path_fast(
                 sx, sy,
                 tx, ty,
-                algorithm="astar",
+                cells,
                 topology="moore"
             )
             if not path or len(path) < 2:
@@ -645,31 +766,20 @@ def transform_rl():
                 simulation.controller.move_element(eid, nx, ny)
                 # record for front-end
                 frontend_moves.append({
-                    "agentId": eid,
-                    "from":   {"x": prev[0] - 1, "y": prev[1] - 1},
-                    "to":     {"x": nx     - 1, "y": ny     - 1}
+                    "agentId": int(eid),
+                    "from":   {"x": int(prev[0]) - 1, "y": int(prev[1]) - 1},
+                    "to":     {"x": int(nx)      - 1, "y": int(ny)      - 1}
                 })
                 prev = (nx, ny)
 
-        # 7) Sanitize moves: convert any numpy ints to Python ints
-        safe_moves = []
-        for m in frontend_moves:
-            safe_moves.append({
-                "agentId": int(m["agentId"]),
-                "from": {
-                    "x": int(m["from"]["x"]),
-                    "y": int(m["from"]["y"])
-                },
-                "to": {
-                    "x": int(m["to"]["x"]),
-                    "y": int(m["to"]["y"])
-                }
-            })
+            # Only cells along the path can have changed
+            for px, py in path:
+                cells[py][px] = int(simulation.grid.grid[py, px])
 
-        # 8) Return JSON-safe response
+        # 7) Return JSON-safe response
         return jsonify({
             "success": True,
-            "moves":   safe_moves,
+            "moves":   frontend_moves,
             "time":    float(round(time.time() - start_time, 2)),
             "nodes":   0,
             "message": f"RL+ASTAR movement completed ({control_mode})"
@@ -685,6 +795,9 @@ def transform_rl():
             "message": f"Error during RL movement: {e}"
         }), 500
 
+    finally:
+        release_envs([a["env"] for a in agents.values()])
+
 
 @app.route('/api/reset', methods=['POST'])
 def reset():
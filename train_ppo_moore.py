@@ -1,93 +1,435 @@
 # train_ppo_moore.py
 
+import io
 import os
+import math
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import gymnasium as gym
-from gymnasium import spaces
 import numpy as np
+import torch
 from stable_baselines3 import PPO
 from stable_baselines3.common.callbacks import CheckpointCallback
+from stable_baselines3.common.vec_env import SubprocVecEnv, VecEnv, VecNormalize
 
-from pm_env_moore import ProgrammableMatterEnvMoore
+from pm_env_moore import (ProgrammableMatterEnvMoore, MOORE_DELTAS,
+                          _ACTION_SPACE, _observation_space)
 from app.controllers.simulation import ProgrammableMatterSimulation
+from app.models.grid import WALL, ELEMENT
 
-def make_env():
+
+def make_sim():
+    """Build the 12x12, 20-element square-formation training simulation."""
+    sim = ProgrammableMatterSimulation(width=12, height=12)
+    sim.initialize_elements(20)
+    sim.set_target_shape('square', 20)
+    sim.controller.assign_targets()
+    return sim
+
+
+class SingleAgentEnv(gym.Env):
     """
-    Create a Gym environment that on each episode:
+    Gym environment that on each episode:
      - Randomly picks one agent from the simulation
      - Passes all the *other* agents' positions into the env as obstacles
      - Exposes the neighbor‐aware obs + collision penalty
     """
-    sim = ProgrammableMatterSimulation(width=12, height=12)
-    sim.initialize_elements(20)
-    sim.set_target_shape('square', 20)
-    sim.controller.assign_targets()
+    def __init__(self, sim, seed=None):
+        super().__init__()
+        self.sim = sim
+        self.grid = sim.grid
+
+        # One RNG, and the (static) elements as int16 columns to draw agents from
+        self._rng = np.random.default_rng(seed)
+        self._ids, self._xs, self._ys, self._txs, self._tys = sim.element_arrays()
+        self._n_elements = len(self._ids)
+
+        # Set in reset()
+        self.eid      = None
+
+        # One env reused across episodes; reset() reconfigures it in place
+        self.env = ProgrammableMatterEnvMoore(
+            grid      = self.grid,
+            start_pos = (0, 0),
+            target_pos= (0, 0),
+            max_steps = 200,
+            collision_penalty = -5.0,
+            success_reward    = 50.0
+        )
+
+        # Cell whose occupancy bit reset() cleared for the current agent
+        self._cleared = None
+
+        # Action & obs spaces are fixed
+        self.action_space = _ACTION_SPACE
+        self.observation_space = _observation_space(self.grid.width, self.grid.height)
+
+    def reset(self, *, seed=None, options=None):
+        # Pick a random agent
+        if seed is not None:
+            self._rng = np.random.default_rng(seed)
+        i = int(self._rng.integers(self._n_elements))
+        self.eid = int(self._ids[i])
+
+        start  = (self._xs[i], self._ys[i])
+        target = (self._txs[i], self._tys[i])
+
+        # The OTHER agents as obstacles: the grid's occupancy mask with the
+        # previous agent's cell restored and this agent's cell cleared
+        obstacles = self.grid.occupancy
+        if self._cleared is not None:
+            obstacles[self._cleared] = 1
+        self._cleared = (start[1], start[0])
+        obstacles[self._cleared] = 0
+
+        # Point the persistent env at this agent's start, goal and obstacles
+        self.env.reconfigure(start, target, obstacles)
+
+        # Seed and reset
+        obs, info = self.env.reset(seed=seed)
+        return obs, info
+
+    def step(self, action):
+        return self.env.step(action)
+
+    def close(self):
+        # Hand the current agent's cell back to the shared occupancy mask
+        if self._cleared is not None:
+            self.grid.occupancy[self._cleared] = 1
+            self._cleared = None
+
+
+class AsyncCheckpointCallback(CheckpointCallback):
+    """
+    CheckpointCallback that writes checkpoints to disk on a background thread.
+
+    The model is still serialized on the training thread, into memory, so the
+    checkpoint is a consistent snapshot; only the file write overlaps with
+    the next rollout. If a write is still queued when the next checkpoint is
+    due, the older one is skipped. A failed write is reported when it
+    finishes. Replay buffer and VecNormalize checkpoints are small or
+    rarely used, so they are still saved synchronously.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._executor = None
+        self._pending = None
+
+    def _init_callback(self) -> None:
+        super()._init_callback()
+        # Per learn() call, since _on_training_end shuts it down
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+
+    @staticmethod
+    def _write(path, data):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    @staticmethod
+    def _report(future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Warning: Failed to write checkpoint: {future.exception()}")
+
+    def _on_step(self) -> bool:
+        if self.n_calls % self.save_freq == 0:
+            model_path = self._checkpoint_path(extension="zip")
+            buf = io.BytesIO()
+            self.model.save(buf)
+
+            if self._pending is not None:
+                self._pending.cancel()
+            self._pending = self._executor.submit(self._write, model_path, buf.getvalue())
+            self._pending.add_done_callback(self._report)
+            if self.verbose >= 2:
+                print(f"Saving model checkpoint to {model_path}")
+
+            if self.save_replay_buffer and getattr(self.model, "replay_buffer", None) is not None:
+                replay_buffer_path = self._checkpoint_path("replay_buffer_", extension="pkl")
+                self.model.save_replay_buffer(replay_buffer_path)
+                if self.verbose >= 2:
+                    print(f"Saving model replay buffer checkpoint to {replay_buffer_path}")
+            if self.save_vecnormalize and self.model.get_vec_normalize_env() is not None:
+                vec_normalize_path = self._checkpoint_path("vecnormalize_", extension="pkl")
+                self.model.get_vec_normalize_env().save(vec_normalize_path)
+                if self.verbose >= 2:
+                    print(f"Saving model VecNormalize to {vec_normalize_path}")
+        return True
+
+    def _on_training_end(self) -> None:
+        # Let the last queued checkpoint finish writing
+        self._executor.shutdown(wait=True)
+
+
+def make_env(rank, seed=0, snapshot=None):
+    """
+    Return a thunk that builds one training env, for SubprocVecEnv.
+
+    Each env gets its own simulation, built inside the worker process.
+
+    Args:
+        rank: Index of the env within the vectorized env
+        seed: Base seed; the worker's NumPy RNGs are seeded with seed + rank
+        snapshot: Optional ProgrammableMatterSimulation.snapshot() to restore
+            instead of placing elements and assigning targets again
+    """
+    def _init():
+        np.random.seed(seed + rank)
+        if snapshot is None:
+            sim = make_sim()
+        else:
+            sim = ProgrammableMatterSimulation(width=12, height=12)
+            sim.restore(snapshot)
+        return SingleAgentEnv(sim, seed=seed + rank)
+
+    return _init
+
+
+# Neighbor offsets in the order ProgrammableMatterEnvMoore lays out its flags
+_NEIGHBOR_DX = np.array([-1, -1, -1, 0, 0, 1, 1, 1], dtype=np.intp)
+_NEIGHBOR_DY = np.array([-1, 0, 1, -1, 1, -1, 0, 1], dtype=np.intp)
+_NEIGHBOR_DIRS = np.arange(8, dtype=np.intp)
+
+
+class MultiAgentVecEnv(VecEnv):
+    """
+    Vectorized env that steps every agent of one simulation at once.
+
+    Each agent with a target is one env slot, so a single step() yields one
+    transition per agent. Observations, actions and rewards match
+    SingleAgentEnv: every element's starting cell stays blocked for the
+    whole episode, so staying on one's own start cell costs the collision
+    penalty. The difference is that the other agents move too, and block
+    the cells they move to. Observations are uint8 rather than float32;
+    SB3 casts non-image Box observations to float unscaled, so the policy
+    sees the same values either way. Agent state lives in int16 arrays and each
+    step is a handful of NumPy operations over all agents.
+
+    When an agent's episode ends (target reached or max_steps) it respawns at
+    its starting cell, which no other agent can enter.
+    """
+
+    def __init__(self, sim, max_steps=200, collision_penalty=-5.0,
+                 success_reward=50.0):
+        if max(sim.grid.width, sim.grid.height) > 256:
+            raise ValueError("MultiAgentVecEnv observations are uint8; the grid must be at most 256 cells wide.")
+        self.grid = sim.grid
+        self.max_steps = max_steps
+        self.collision_penalty = collision_penalty
+        self.success_reward = success_reward
+        self.render_mode = None
+
+        # Agent state as struct-of-arrays, one row per agent with a target
+        _, xs, ys, txs, tys = sim.element_arrays()
+        has_target = txs >= 0
+        self.start_xs, self.start_ys = xs[has_target], ys[has_target]
+        self.tx, self.ty = txs[has_target], tys[has_target]
+        self.xs = self.start_xs.copy()
+        self.ys = self.start_ys.copy()
+        n = len(self.xs)
+        self.steps = np.zeros(n, dtype=np.int32)
+
+        # Walls and the elements' starting cells, which the single-agent env
+        # sees as ELEMENT cells on the grid throughout
+        self._static = (self.grid.grid == WALL) | (self.grid.grid == ELEMENT)
+        # Cells agents sit on, and for every cell the blocked flags of its 8
+        # neighbors (padded by one cell on each side); both are updated as
+        # agents move rather than rebuilt. The table has the observation dtype
+        # so rows copy straight into observations, and _neighbor_rows views
+        # it as one row per padded cell
+        self._occupied = np.zeros(self._static.shape, dtype=bool)
+        self._neighbors = np.zeros((self._static.shape[0] + 2, self._static.shape[1] + 2, 8),
+                                   dtype=np.uint8)
+        self._neighbor_rows = self._neighbors.reshape(-1, 8)
+        self._actions = None
+
+        # Two preallocated (N, 12) observation batches used in turn; the
+        # target columns never change so they are written once here
+        self._obs_bufs = (np.empty((n, 12), dtype=np.uint8),
+                          np.empty((n, 12), dtype=np.uint8))
+        for buf in self._obs_bufs:
+            buf[:, 2] = self.tx
+            buf[:, 3] = self.ty
+        self._obs_index = 0
+        self._rebuild_occupancy()
+
+        super().__init__(
+            n,
+            _observation_space(self.grid.width, self.grid.height, np.uint8),
+            _ACTION_SPACE,
+        )
+
+    def _next_obs_buf(self):
+        """
+        Return the observation buffer to fill next.
+
+        Buffers are used in turn, so the batch returned by the previous step
+        stays intact while PPO still holds it.
+        """
+        obs = self._obs_bufs[self._obs_index]
+        self._obs_index ^= 1
+        return obs
+
+    def _rebuild_occupancy(self):
+        """Recompute the occupancy mask and neighbor table from xs, ys."""
+        height, width = self._static.shape
+        self._occupied[:] = False
+        self._occupied[self.ys, self.xs] = True
+
+        # Static cells and agents, padded so off-grid neighbors read as blocked
+        blocked = np.pad(self._static | self._occupied, 1, constant_values=True)
+        for k in range(8):
+            dx, dy = _NEIGHBOR_DX[k], _NEIGHBOR_DY[k]
+            self._neighbors[1:-1, 1:-1, k] = blocked[1 + dy:1 + dy + height,
+                                                     1 + dx:1 + dx + width]
+
+    def _set_occupied(self, xs, ys, value):
+        """Mark the cells xs, ys as occupied or free."""
+        self._occupied[ys, xs] = value
+        # A freed start cell stays blocked; a cell is neighbor k of the cell
+        # one step against direction k
+        self._neighbors[ys[:, None] + 1 - _NEIGHBOR_DY,
+                        xs[:, None] + 1 - _NEIGHBOR_DX,
+                        _NEIGHBOR_DIRS] = (self._static[ys, xs] | value)[:, None]
+
+    def _fill_obs(self, obs):
+        """Write [ax,ay,tx,ty] plus 8 neighbor-blocked flags per agent into obs."""
+        obs[:, 0] = self.xs
+        obs[:, 1] = self.ys
+        # Gather every agent's neighbor row straight into the batch
+        rows = (self.ys.astype(np.intp) + 1) * self._neighbors.shape[1] + (self.xs + 1)
+        np.take(self._neighbor_rows, rows, axis=0, out=obs[:, 4:])
+        return obs
 
-    class SingleAgentEnv(gym.Env):
-        def __init__(self):
-            super().__init__()
-            self.sim = sim
-            self.grid = sim.grid
-
-            # These will be set in reset()
-            self.eid      = None
-            self.env      = None
-
-            # Action & obs spaces are fixed
-            self.action_space = spaces.Discrete(9)
-            low  = np.array([0,0,0,0] + [0]*8, dtype=np.float32)
-            high = np.array(
-                [self.grid.width-1, self.grid.height-1,
-                 self.grid.width-1, self.grid.height-1] + [1]*8,
-                dtype=np.float32
-            )
-            self.observation_space = spaces.Box(low=low, high=high, dtype=np.float32)
-
-        def reset(self, *, seed=None, options=None):
-            # Pick a random agent
-            rng_keys = list(self.sim.controller.elements.keys())
-            self.eid = (np.random.RandomState(seed)
-                        .choice(rng_keys)) if seed is not None else np.random.choice(rng_keys)
-            elem = self.sim.controller.elements[self.eid]
-
-            start  = (elem.x, elem.y)
-            target = (elem.target_x, elem.target_y)
-
-            # Compute the OTHER agents as obstacles
-            obstacles = {
-                (other.x, other.y)
-                for oid, other in self.sim.controller.elements.items()
-                if oid != self.eid
-            }
-
-            # Create the environment with dynamic obstacle set
-            self.env = ProgrammableMatterEnvMoore(
-                grid      = self.grid,
-                start_pos = start,
-                target_pos= target,
-                obstacles = obstacles,       # <-- pass neighbors in
-                max_steps = 200,
-                collision_penalty = -5.0,
-                success_reward    = 50.0
-            )
-
-            # Seed and reset
-            obs, info = self.env.reset(seed=seed)
-            return obs, info
-
-        def step(self, action):
-            return self.env.step(action)
-
-    return SingleAgentEnv()
+    def _respawn(self, idx):
+        """Start a new episode for the agents in idx."""
+        self._set_occupied(self.xs[idx], self.ys[idx], False)
+        self.xs[idx] = self.start_xs[idx]
+        self.ys[idx] = self.start_ys[idx]
+        self._set_occupied(self.xs[idx], self.ys[idx], True)
+        self.steps[idx] = 0
+
+    def reset(self):
+        self.xs[:] = self.start_xs
+        self.ys[:] = self.start_ys
+        self.steps[:] = 0
+        self._rebuild_occupancy()
+        return self._fill_obs(self._next_obs_buf())
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions, dtype=np.intp)
+
+    def step_wait(self):
+        height, width = self._static.shape
+        self.steps += 1
+
+        # Proposed positions, clipped to the grid like the single-agent env
+        deltas = MOORE_DELTAS[self._actions]
+        nx = np.clip(self.xs + deltas[:, 0], 0, width - 1).astype(np.int16)
+        ny = np.clip(self.ys + deltas[:, 1], 0, height - 1).astype(np.int16)
+        moved = (nx != self.xs) | (ny != self.ys)
+
+        # Ending on a static cell is blocked, even when not moving (staying on
+        # one's own start cell), as in the single-agent env; a move is also
+        # blocked by a cell an agent currently sits on, or another agent
+        # heading for the same cell (counted per flat cell)
+        flat = ny.astype(np.intp) * width + nx
+        counts = np.bincount(flat, minlength=height * width)
+        collided = self._static[ny, nx] | (moved & (self._occupied[ny, nx] |
+                                                    (counts[flat] > 1)))
+
+        old_dist = np.hypot(self.xs - self.tx, self.ys - self.ty)
+        going = moved & ~collided
+        self._set_occupied(self.xs[going], self.ys[going], False)
+        self.xs = np.where(collided, self.xs, nx)
+        self.ys = np.where(collided, self.ys, ny)
+        self._set_occupied(self.xs[going], self.ys[going], True)
+        new_dist = np.hypot(self.xs - self.tx, self.ys - self.ty)
+
+        # Shaped reward: closer → positive, big bonus on success
+        reached = new_dist == 0
+        rewards = np.where(
+            collided, self.collision_penalty,
+            (old_dist - new_dist) * 2.0 + np.where(reached, self.success_reward, 0.0)
+        ).astype(np.float32)
+
+        truncated = ~reached & (self.steps >= self.max_steps)
+        dones = reached | truncated
+
+        obs = self._fill_obs(self._next_obs_buf())
+        infos = [{} for _ in range(self.num_envs)]
+        done_idx = np.flatnonzero(dones)
+        if done_idx.size:
+            for i in done_idx:
+                infos[i]["terminal_observation"] = obs[i].copy()
+                infos[i]["TimeLimit.truncated"] = bool(truncated[i])
+            self._respawn(done_idx)
+            self._fill_obs(obs)
+
+        return obs, rewards, dones, infos
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self, method_name)(*method_args, **method_kwargs)
+                for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the Moore-neighborhood PPO policy")
+    parser.add_argument("--num-envs", type=int, default=os.cpu_count() or 1,
+                        help="Number of environments stepped in parallel worker processes")
+    parser.add_argument("--multi-agent", action="store_true",
+                        help="Step all agents of one simulation together in a "
+                             "MultiAgentVecEnv instead of one agent per worker")
+    parser.add_argument("--device", default="auto",
+                        help="Torch device for the policy, e.g. cuda or cpu (default: cuda if available)")
+    parser.add_argument("--batch-size", type=int, default=512,
+                        help="PPO minibatch size")
+    parser.add_argument("--normalize-reward", action="store_true",
+                        help="Normalize rewards with VecNormalize (observations are left as is)")
+    parser.add_argument("--compile", action="store_true",
+                        help="torch.compile the policy forward pass used during rollouts")
+    args = parser.parse_args()
+
     os.makedirs("models", exist_ok=True)
 
-    env = make_env()
-    checkpoint_cb = CheckpointCallback(
-        save_freq  = 20_000,
+    if args.multi_agent:
+        env = MultiAgentVecEnv(make_sim())
+    else:
+        # Lay out the board once; workers restore their own copy of it
+        snapshot = make_sim().snapshot()
+        env = SubprocVecEnv([make_env(i, snapshot=snapshot) for i in range(max(args.num_envs, 1))])
+    num_envs = env.num_envs
+
+    if args.normalize_reward:
+        # Observations are already small bounded ints and flags, so only
+        # rewards get running statistics; the policy keeps raw observations
+        # and runs unchanged on the server's envs
+        env = VecNormalize(env, norm_obs=False, norm_reward=True, clip_reward=10.0)
+
+    # At least ~2048 transitions per update, rounded up so the rollout splits
+    # into whole minibatches
+    step_multiple = args.batch_size // math.gcd(args.batch_size, num_envs)
+    n_steps = max(math.ceil(2048 / num_envs / step_multiple), 1) * step_multiple
+
+    # Callback frequencies count vectorized steps (num_envs transitions each)
+    checkpoint_cb = AsyncCheckpointCallback(
+        save_freq  = max(50_000 // num_envs, 1),
         save_path  = "models/",
-        name_prefix= "ppo_moore"
+        name_prefix= "ppo_moore",
+        save_vecnormalize = args.normalize_reward
     )
    
 
@@ -96,13 +438,25 @@ if __name__ == "__main__":
         env            = env,
         verbose        = 1,
         learning_rate  = 3e-4,
-        batch_size     = 64,
+        n_steps        = n_steps,
+        batch_size     = args.batch_size,  # few large minibatches per epoch
+        n_epochs       = 10,
         gamma          = 0.99,
+        gae_lambda     = 0.95,
+        device         = args.device,
     )
 
-    # Train for 500k timesteps, saving intermediate checkpoints
+    if args.compile:
+        # Rollouts call the policy with a fixed batch of num_envs observations,
+        # so the compiled graph (a CUDA graph on GPU) is not recompiled
+        mode = "reduce-overhead" if model.device.type == "cuda" else "default"
+        model.policy.forward = torch.compile(model.policy.forward, mode=mode)
+
+    # Train for 500k timesteps, saving a checkpoint every 50k
     model.learn(total_timesteps=500_000, callback=checkpoint_cb)
 
     # Final save
     model.save("models/ppo_moore_final")
+    if args.normalize_reward:
+        env.save("models/ppo_moore_final_vecnormalize.pkl")
     print("Training complete, model saved to models/ppo_moore_final.zip")